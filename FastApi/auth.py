@@ -1,10 +1,18 @@
 import jwt
 import os
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from bson import ObjectId
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
 from typing import Optional
+from db import get_db
 
 # Load environment variables
 from dotenv import load_dotenv
@@ -13,32 +21,51 @@ load_dotenv()
 # Secret Key and Algorithm
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "default-secret-key")  # Provide a fallback in case the env variable is not set
 JWT_ALGORITHM = "HS256"
-JWT_EXPIRATION_MINUTES = 30
+# Lifetime of login (and email verification) tokens; the frontend logs out when it runs out
+JWT_EXPIRATION_MINUTES = int(os.getenv("JWT_EXPIRATION_MINUTES", str(7 * 24 * 60)))
+# Purpose claim ("type"): only access tokens authenticate API requests, and the token in the email
+# verification link can only verify the account
+ACCESS_TOKEN = "access"
+VERIFY_TOKEN = "verify"
 
 # Initialize password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt takes ~250 ms of CPU per call: run it on a small dedicated pool so login/signup bursts
+# queue there instead of occupying the event loop or the shared request threadpool
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+# Authenticated users are cached for a short time so a request doesn't cost a Mongo lookup
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_USERS = int(os.getenv("AUTH_CACHE_MAX_USERS", "10000"))
+
 # JWT Token Creation
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, token_type: str = ACCESS_TOKEN):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=JWT_EXPIRATION_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": token_type})
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
 # Verify JWT Token
-def verify_token(token: str):
+def verify_token(token: str, token_type: str = ACCESS_TOKEN):
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        return payload
     except jwt.PyJWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials",
         )
+    if payload.get("type") != token_type:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid credentials",
+        )
+    return payload
 
 # Password Verification
 def verify_password(plain_password, hashed_password):
@@ -47,3 +74,109 @@ def verify_password(plain_password, hashed_password):
 # Hash Password
 def hash_password(password: str):
     return pwd_context.hash(password)
+
+async def verify_password_async(plain_password, hashed_password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, verify_password, plain_password, hashed_password)
+
+async def hash_password_async(password: str):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, hash_password, password)
+
+
+class PrincipalCache:
+    """user_id -> authenticated user (with the ids of their chats), kept for ttl_seconds."""
+
+    def __init__(self, ttl_seconds: float, max_users: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._entries = OrderedDict()  # user_id -> (expires_at, principal)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id: str, principal: dict):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, principal)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        """Forget a user whose chats (or account) changed, so the next request reloads them."""
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+principal_cache = PrincipalCache(ttl_seconds=AUTH_CACHE_TTL_SECONDS, max_users=AUTH_CACHE_MAX_USERS)
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)) -> dict:
+    """FastAPI dependency: the verified user behind the request's bearer token."""
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    payload = verify_token(credentials.credentials)
+    user_id = payload.get("user_id")
+    if not user_id or not ObjectId.is_valid(user_id):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        principal = await load_principal(user_id)
+    return principal
+
+
+async def load_principal(user_id: str) -> dict:
+    """Read the user and their chat ids from Mongo and cache them."""
+    user = await get_db().users.find_one({"_id": ObjectId(user_id)}, {"name": 1, "email": 1, "verify": 1, "chat_ids": 1})
+    if not user or not user.get("verify", False):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    principal = {
+        "_id": user_id,
+        "name": user["name"],
+        "email": user["email"],
+        "chat_ids": frozenset(str(chat_id) for chat_id in user.get("chat_ids", [])),
+    }
+    principal_cache.put(user_id, principal)
+    return principal
+
+
+async def require_chat(user: dict, chat_id: str) -> dict:
+    """404 unless the chat belongs to the user (unknown and foreign chats look the same).
+
+    The cached chat ids can miss a chat created by another worker, so a miss reloads them once.
+    Returns the (possibly reloaded) user.
+    """
+    if not ObjectId.is_valid(chat_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
+    if chat_id not in user["chat_ids"]:
+        user = await load_principal(user["_id"])
+        if chat_id not in user["chat_ids"]:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
+    return user
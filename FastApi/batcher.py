@@ -0,0 +1,88 @@
+# batcher.py
+import threading
+import time
+import queue
+from collections import Counter
+from concurrent.futures import Future
+
+
+class EmbeddingBatcher:
+    """Collects texts submitted from many request threads and encodes them together.
+
+    A single background thread takes the first waiting text, keeps collecting for up to
+    max_wait_ms (or until max_batch_size texts are queued) and runs one encode call for
+    the whole batch. Every caller blocks only on its own future.
+    """
+
+    def __init__(self, encode, max_batch_size: int = 32, max_wait_ms: float = 5):
+        self._encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batch_sizes = Counter()  # achieved batch size -> number of batches
+
+    def encode(self, text: str):
+        return self.encode_many([text])[0]
+
+    def encode_many(self, texts):
+        """Encode several texts of one caller, queued together so they usually share a batch."""
+        futures = []
+        for text in texts:
+            future = Future()
+            self._queue.put((text, future))
+            futures.append(future)
+        self._ensure_started()
+        return [future.result() for future in futures]
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self._encode(texts)
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+            with self._stats_lock:
+                self.batch_sizes[len(batch)] += 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            batches = sum(self.batch_sizes.values())
+            items = sum(size * count for size, count in self.batch_sizes.items())
+            return {
+                "batches": batches,
+                "items": items,
+                "mean_batch_size": items / batches if batches else 0.0,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
@@ -0,0 +1,375 @@
+# benchmark.py
+# Times every stage of the ingestion and question-answering pipeline, plus the /chat/create and
+# /chat/message endpoints, on generated documents of several sizes and formats. The endpoints run
+# against in-memory MongoDB (mongomock://) and local blob storage unless BENCHMARK_MONGO_URI is set.
+#
+#   python benchmark.py [--sizes small,medium] [--formats pdf,txt] [--repeat 3] [--no-endpoints]
+#   python benchmark.py --save-baseline bench.json
+#   python benchmark.py --baseline bench.json [--threshold 0.2]
+import os
+import tempfile
+
+# Stand-ins must be configured before db/storage read their settings
+os.environ["MONGO_URI"] = os.getenv("BENCHMARK_MONGO_URI", "mongomock://")
+os.environ["STORAGE_BACKEND"] = "local"
+os.environ["UPLOAD_DIRECTORY"] = os.path.join(tempfile.gettempdir(), "docgenius-benchmark")
+
+import argparse
+import json
+import resource
+import sys
+import time
+from collections import defaultdict
+from io import BytesIO
+import numpy as np
+from docx import Document
+from extractors import iter_pages
+from chunking import chunk_pages
+from model_registry import registry, get_embedding_model
+from services import clean_text, summarize_text, EMBEDDING_BATCH_SIZE
+from utils import build_faiss_index, search_faiss, structure_response
+
+# Pages per generated document
+SIZES = {"small": 2, "medium": 20, "large": 100}
+FORMATS = ("pdf", "docx", "html", "txt")
+STAGES = ("extract", "chunk", "encode", "build_index", "search", "summarize", "answer")
+QUESTIONS = [
+    "When is the payment due?",
+    "Who approves the invoices?",
+    "What does the warranty cover?",
+    "How many days notice is required?",
+    "What happens after the contract ends?",
+]
+
+WORDS = (
+    "the contract supplier customer invoice payment warranty service delivery period notice party "
+    "agreement term renewal shipment schedule report account review approval policy clause section "
+    "fee rate month quarter annual written request receipt obligation liability claim support"
+).split()
+
+
+def generate_pages(pages: int, seed: int, words_per_page: int = 300):
+    """Deterministic pseudo-document text: sentences with numbers and abbreviations, one string per page."""
+    rng = np.random.default_rng(seed)
+    result = []
+    for page in range(pages):
+        sentences, count = [], 0
+        while count < words_per_page:
+            length = int(rng.integers(8, 25))
+            words = [WORDS[i] for i in rng.integers(0, len(WORDS), size=length)]
+            if rng.random() < 0.2:
+                words.insert(int(rng.integers(0, length)), f"{rng.integers(1, 99)}.{rng.integers(0, 99):02d}")
+            if rng.random() < 0.1:
+                words.insert(0, "Dr. Smith said")
+            sentences.append(" ".join(words).capitalize() + ".")
+            count += len(words)
+        result.append(" ".join(sentences))
+    return result
+
+
+def _wrap(text: str, width: int = 95):
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def make_pdf(pages) -> bytes:
+    """A minimal text PDF (Helvetica, one content stream per page) that PyPDF2 can extract."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for text in pages:
+        lines = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in _wrap(text)]
+        stream = "BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    out = BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def make_docx(pages) -> bytes:
+    doc = Document()
+    for text in pages:
+        doc.add_paragraph(text)
+    out = BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+def make_html(pages) -> bytes:
+    body = "".join(f"<section><h2>Page {i}</h2><p>{text}</p></section>" for i, text in enumerate(pages, start=1))
+    return f"<html><head><title>Benchmark</title></head><body>{body}</body></html>".encode("utf-8")
+
+
+def make_document(file_format: str, pages: int, seed: int) -> bytes:
+    texts = generate_pages(pages, seed)
+    if file_format == "pdf":
+        return make_pdf(texts)
+    if file_format == "docx":
+        return make_docx(texts)
+    if file_format == "html":
+        return make_html(texts)
+    return "\n\n".join(texts).encode("utf-8")
+
+
+def _proc_status_mb(field: str):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _lifetime_peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def rss_mark() -> float:
+    """Reset the peak RSS to the current RSS and return it (MB), so peak_rss_mb covers only what follows.
+
+    Linux resets the VmHWM high-water mark through /proc/self/clear_refs. Elsewhere the only peak is
+    the lifetime ru_maxrss, so a call then shows growth only when it raises the process' peak.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return _lifetime_peak_rss_mb()
+    return _proc_status_mb("VmRSS") or 0.0
+
+
+def peak_rss_mb() -> float:
+    """Highest RSS (MB) since the last rss_mark."""
+    return _proc_status_mb("VmHWM") or _lifetime_peak_rss_mb()
+
+
+class Recorder:
+    """Collects (seconds, items, peak RSS growth) samples per benchmark key.
+
+    Each measured call starts with start() and ends with add(); the RSS growth is how far the
+    process' peak RSS rose above its RSS at the start of that call.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.units = {}
+
+    def start(self):
+        return time.perf_counter(), rss_mark()
+
+    def time(self, key: str, unit: str, fn, *args, items=None):
+        started = self.start()
+        result = fn(*args)
+        self.add(key, unit, started, items(result) if items else 1)
+        return result
+
+    def add(self, key: str, unit: str, started, items: int = 1):
+        start, rss = started
+        seconds = time.perf_counter() - start
+        self.samples[key].append((seconds, items, max(peak_rss_mb() - rss, 0.0)))
+        self.units[key] = unit
+
+    def report(self):
+        rows = {}
+        for key, samples in self.samples.items():
+            seconds = np.array([s for s, _, _ in samples])
+            items = sum(n for _, n, _ in samples)
+            rows[key] = {
+                "runs": len(samples),
+                "p50_ms": float(np.percentile(seconds, 50) * 1000),
+                "p95_ms": float(np.percentile(seconds, 95) * 1000),
+                "mean_ms": float(seconds.mean() * 1000),
+                "throughput": items / seconds.sum() if seconds.sum() else 0.0,
+                "unit": self.units[key],
+                # Worst call: memory it needed on top of what the process already held
+                "rss_growth_mb": max(growth for _, _, growth in samples),
+            }
+        return rows
+
+
+def bench_pipeline(recorder: Recorder, workdir: str, sizes, formats, stages, repeat: int):
+    embedding_model = get_embedding_model()
+    questions = embedding_model.encode(QUESTIONS)
+
+    for size in sizes:
+        for file_format in formats:
+            for run in range(repeat):
+                path = os.path.join(workdir, f"{size}-{run}.{file_format}")
+                with open(path, "wb") as f:
+                    f.write(make_document(file_format, SIZES[size], seed=run))
+                name = f"{file_format}/{size}"
+
+                pages = recorder.time(f"extract/{name}", "pages/s", lambda: list(iter_pages(path, file_format)), items=len)
+
+                # Everything below is format independent, so it only runs once per size
+                if file_format != formats[0]:
+                    continue
+
+                chunks = recorder.time(
+                    f"chunk/{size}", "chunks/s",
+                    lambda: list(chunk_pages(iter(pages), embedding_model.tokenizer)), items=len,
+                )
+                texts = [chunk["text"] for chunk in chunks]
+                embeddings = recorder.time(
+                    f"encode/{size}", "chunks/s",
+                    lambda: embedding_model.encode(texts, batch_size=EMBEDDING_BATCH_SIZE), items=len,
+                )
+                index = recorder.time(f"build_index/{size}", "vectors/s", build_faiss_index, embeddings, items=lambda _: len(embeddings))
+
+                top = []
+                for question in questions:
+                    indices, _ = recorder.time(f"search/{size}", "queries/s", search_faiss, index, question, 3)
+                    top = [texts[i] for i in indices if i >= 0]
+
+                if "summarize" in stages:
+                    text = clean_text("\n".join(text for _, text in pages))
+                    recorder.time(f"summarize/{size}", "docs/s", summarize_text, text)
+                if "answer" in stages:
+                    recorder.time(f"answer/{size}", "answers/s", structure_response, top)
+
+    # Stages feeding later ones always run; only the selected ones are reported
+    for stage in set(STAGES) - set(stages):
+        for key in [key for key in recorder.samples if key.startswith(f"{stage}/")]:
+            recorder.samples.pop(key)
+
+
+def bench_endpoints(recorder: Recorder, sizes, formats, repeat: int, timeout: float = 600):
+    from fastapi.testclient import TestClient
+    import db
+    import main
+    from auth import hash_password, create_access_token
+    from cache import answer_cache
+
+    with TestClient(main.app) as client:
+        user = {"name": "benchmark", "email": "benchmark@example.com", "password": hash_password("benchmark"), "verify": True}
+        user_id = str(client.portal.call(db.get_db().users.insert_one, user).inserted_id)
+        client.headers["Authorization"] = f"Bearer {create_access_token({'user_id': user_id})}"
+
+        for size in sizes:
+            for file_format in formats:
+                name = f"{file_format}/{size}"
+                for run in range(repeat):
+                    # A fresh seed per upload so content-hash deduplication doesn't skip the work
+                    content = make_document(file_format, SIZES[size], seed=1000 + run)
+                    started = recorder.start()
+                    response = client.post(
+                        "/chat/create",
+                        files={"file": (f"benchmark-{size}-{run}.{file_format}", content)},
+                    )
+                    response.raise_for_status()
+                    recorder.add(f"create_request/{name}", "uploads/s", started)
+                    chat_id = response.json()["_id"]
+
+                    # Ingestion runs in the background: wait until the chat can be queried
+                    while True:
+                        status = client.get(f"/chat/status/{chat_id}").json()
+                        if status["status"] == "done":
+                            break
+                        if status["status"] == "failed" or time.perf_counter() - started[0] > timeout:
+                            raise RuntimeError(f"Ingestion of {name} did not finish: {status}")
+                        time.sleep(0.02)
+                    recorder.add(f"create_ready/{name}", "docs/s", started)
+
+                    for question in QUESTIONS:
+                        # Measure the full retrieval and generation path, not the answer cache
+                        answer_cache.invalidate(chat_id)
+                        started = recorder.start()
+                        client.post("/chat/message", json={"chat_id": chat_id, "text": question}).raise_for_status()
+                        recorder.add(f"message/{name}", "messages/s", started)
+
+
+def compare(rows, baseline, threshold: float):
+    """Return (key, field, old, new) for every p50/p95 latency that got slower than the threshold allows."""
+    regressions = []
+    for key, row in rows.items():
+        old = baseline.get(key)
+        if not old:
+            continue
+        for field in ("p50_ms", "p95_ms"):
+            if old[field] > 0 and row[field] > old[field] * (1 + threshold):
+                regressions.append((key, field, old[field], row[field]))
+    return regressions
+
+
+def print_report(rows, baseline=None):
+    print(f"{'benchmark':<28} {'runs':>5} {'p50 ms':>10} {'p95 ms':>10} {'throughput':>18} {'+RSS MB':>12} {'p50 vs base':>12}")
+    for key in sorted(rows):
+        row = rows[key]
+        delta = ""
+        if baseline and key in baseline and baseline[key]["p50_ms"] > 0:
+            delta = f"{(row['p50_ms'] / baseline[key]['p50_ms'] - 1) * 100:+.1f}%"
+        throughput = f"{row['throughput']:.1f} {row['unit']}"
+        print(f"{key:<28} {row['runs']:>5} {row['p50_ms']:>10.1f} {row['p95_ms']:>10.1f} {throughput:>18} {row['rss_growth_mb']:>12.1f} {delta:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DocGenius ingestion and QA pipeline")
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma separated, from {', '.join(SIZES)}")
+    parser.add_argument("--formats", default=",".join(FORMATS), help=f"Comma separated, from {', '.join(FORMATS)}")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma separated, from {', '.join(STAGES)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-endpoints", action="store_true", help="Skip the /chat/create and /chat/message runs")
+    parser.add_argument("--save-baseline", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results saved with --save-baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed p50/p95 slowdown before failing")
+    args = parser.parse_args()
+
+    sizes, formats, stages = args.sizes.split(","), args.formats.split(","), args.stages.split(",")
+    for value, known in ((sizes, SIZES), (formats, FORMATS), (stages, STAGES)):
+        unknown = set(value) - set(known)
+        if unknown:
+            parser.error(f"unknown value(s): {', '.join(sorted(unknown))}")
+
+    # Model loading is reported by /models/stats; keep it out of the stage timings
+    registry.warm_up()
+
+    recorder = Recorder()
+    with tempfile.TemporaryDirectory() as workdir:
+        bench_pipeline(recorder, workdir, sizes, formats, stages, args.repeat)
+    if not args.no_endpoints:
+        bench_endpoints(recorder, sizes, formats, args.repeat)
+
+    rows = recorder.report()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    print_report(rows, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": rows}, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if baseline:
+        regressions = compare(rows, baseline, args.threshold)
+        for key, field, old, new in regressions:
+            print(f"REGRESSION {key} {field}: {old:.1f} ms -> {new:.1f} ms")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,199 @@
+# cache.py
+import os
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+
+# Memory budget for cached FAISS indexes (in MB)
+INDEX_CACHE_MAX_MB = int(os.getenv("INDEX_CACHE_MAX_MB", "512"))
+
+# Semantic answer cache: cosine similarity needed for a hit, entry lifetime, and size limits
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_PER_CHAT = int(os.getenv("ANSWER_CACHE_MAX_PER_CHAT", "50"))
+ANSWER_CACHE_MAX_CHATS = int(os.getenv("ANSWER_CACHE_MAX_CHATS", "1000"))
+
+
+def index_nbytes(index, mapped: bool = False) -> int:
+    """Approximate memory held by a FAISS index (vectors stored as float32, plus graph links or list ids).
+
+    The vectors and inverted lists of a mapped index live in the shared page cache, so only the
+    HNSW links and IVF centroids count for it.
+    """
+    nbytes = 0 if mapped else int(index.ntotal) * int(index.d) * 4
+    if hasattr(index, "hnsw"):
+        # Each vector keeps 2*M neighbour ids on the base level
+        nbytes += int(index.ntotal) * int(index.hnsw.nb_neighbors(0)) * 4
+    elif hasattr(index, "nlist"):
+        nbytes += (0 if mapped else int(index.ntotal) * 8) + int(index.nlist) * int(index.d) * 4
+    return nbytes
+
+
+class DocumentIndex:
+    """A document's FAISS index with the chunk texts and locations its vector ids point at."""
+
+    def __init__(self, index, sentences, chunks, index_bytes: int):
+        self.index = index
+        self.sentences = sentences
+        self.chunks = chunks
+        self.nbytes = index_bytes + sum(len(sentence) for sentence in sentences)
+
+
+class IndexCache:
+    """In-process LRU cache of document indexes (DocumentIndex) keyed by chat_id, bounded by memory."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # chat_id -> (index, nbytes)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, chat_id: str):
+        with self._lock:
+            return chat_id in self._entries
+
+    def get(self, chat_id: str):
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(chat_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, chat_id: str, index: DocumentIndex):
+        nbytes = index.nbytes
+        with self._lock:
+            old = self._entries.pop(chat_id, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            # An index bigger than the whole budget is never cached
+            if nbytes > self.max_bytes:
+                return
+            self._entries[chat_id] = (index, nbytes)
+            self.current_bytes += nbytes
+            # Evict least recently used indexes until we are back under budget
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def invalidate(self, chat_id: str):
+        with self._lock:
+            entry = self._entries.pop(chat_id, None)
+            if entry is not None:
+                self.current_bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+index_cache = IndexCache(max_bytes=INDEX_CACHE_MAX_MB * 1024 * 1024)
+
+
+class AnswerCache:
+    """Per-chat cache of generated answers (and their sources) keyed by the (normalized) query embedding.
+
+    A lookup hits when a stored query is within `threshold` cosine similarity of the new one,
+    so repeated and near-duplicate questions skip retrieval and BART generation.
+    """
+
+    def __init__(self, threshold: float, ttl_seconds: int, max_per_chat: int, max_chats: int):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_per_chat = max_per_chat
+        self.max_chats = max_chats
+        self._chats = OrderedDict()  # chat_id -> OrderedDict(key -> (vector, answer, stored_at))
+        self._lock = threading.Lock()
+        self._next_key = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype="float32")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, entries):
+        cutoff = time.monotonic() - self.ttl_seconds
+        for key in [key for key, (_, _, stored_at) in entries.items() if stored_at < cutoff]:
+            del entries[key]
+
+    def get(self, chat_id: str, query_vector):
+        query = self._normalize(query_vector)
+        with self._lock:
+            entries = self._chats.get(chat_id)
+            if entries:
+                self._expire(entries)
+            if not entries:
+                self.misses += 1
+                return None
+
+            keys = list(entries)
+            similarities = np.stack([entries[key][0] for key in keys]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entries.move_to_end(keys[best])
+            self._chats.move_to_end(chat_id)
+            self.hits += 1
+            return entries[keys[best]][1]
+
+    def put(self, chat_id: str, query_vector, answer: dict):
+        query = self._normalize(query_vector)
+        with self._lock:
+            entries = self._chats.setdefault(chat_id, OrderedDict())
+            self._chats.move_to_end(chat_id)
+            entries[self._next_key] = (query, answer, time.monotonic())
+            self._next_key += 1
+
+            while len(entries) > self.max_per_chat:
+                entries.popitem(last=False)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+
+    def invalidate(self, chat_id: str):
+        with self._lock:
+            self._chats.pop(chat_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "chats": len(self._chats),
+                "entries": sum(len(entries) for entries in self._chats.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+answer_cache = AnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    max_per_chat=ANSWER_CACHE_MAX_PER_CHAT,
+    max_chats=ANSWER_CACHE_MAX_CHATS,
+)
@@ -0,0 +1,116 @@
+# chunking.py
+import os
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+# Chunk size in embedding-model tokens (MiniLM was trained on 128-token inputs) and how many
+# trailing sentences of a chunk are repeated at the start of the next one
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "128"))
+CHUNK_OVERLAP_SENTENCES = int(os.getenv("CHUNK_OVERLAP_SENTENCES", "1"))
+
+# Sentence-ending punctuation (plus closing quotes/brackets) followed by whitespace
+_BOUNDARY = re.compile(r'([.!?]["\')\]]*)(\s+)')
+_PARAGRAPH = re.compile(r'\n\s*\n')
+_LAST_WORD = re.compile(r'([\w.]+)$')
+_ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "etc", "inc", "ltd", "co",
+    "corp", "no", "fig", "eq", "sec", "vol", "approx", "dept", "est", "e.g", "i.e",
+}
+
+
+def _strip_span(text: str, start: int, end: int):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """Split text into sentences, returned as (start, end) character offsets.
+
+    Periods inside numbers and URLs are never followed by whitespace, and common
+    abbreviations or a lowercase continuation don't end a sentence.
+    """
+    spans = []
+    for para_start, para_end in _paragraph_spans(text):
+        start = para_start
+        for match in _BOUNDARY.finditer(text, para_start, para_end):
+            next_char = text[match.end()] if match.end() < para_end else ""
+            if next_char.islower():
+                continue
+            last_word = _LAST_WORD.search(text, start, match.start(1))
+            if last_word and match.group(1)[0] == "." and last_word.group(1).lower() in _ABBREVIATIONS:
+                continue
+            span = _strip_span(text, start, match.end(1))
+            if span[0] < span[1]:
+                spans.append(span)
+            start = match.end()
+        span = _strip_span(text, start, para_end)
+        if span[0] < span[1]:
+            spans.append(span)
+    return spans
+
+
+def _paragraph_spans(text: str):
+    start = 0
+    for match in _PARAGRAPH.finditer(text):
+        yield start, match.start()
+        start = match.end()
+    yield start, len(text)
+
+
+def _token_windows(start: int, offsets, max_tokens: int):
+    """Cut an overlong sentence into windows of at most max_tokens tokens."""
+    for i in range(0, len(offsets), max_tokens):
+        window = offsets[i:i + max_tokens]
+        yield start + window[0][0], start + window[-1][1], len(window)
+
+
+def chunk_text(text: str, tokenizer, max_tokens: int = CHUNK_MAX_TOKENS,
+               overlap: int = CHUNK_OVERLAP_SENTENCES, page: int = 1) -> List[dict]:
+    """Pack whole sentences into chunks of at most max_tokens tokens.
+
+    Each chunk is a dict with its text, the page it came from and its start/end
+    character offsets within that page's text.
+    """
+    spans = sentence_spans(text)
+    if not spans:
+        return []
+    encoded = tokenizer(
+        [text[start:end] for start, end in spans],
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+    )
+
+    # (start, end, token_count) units that each fit in a chunk
+    units = []
+    for (start, end), offsets in zip(spans, encoded["offset_mapping"]):
+        if len(offsets) > max_tokens:
+            units.extend(_token_windows(start, offsets, max_tokens))
+        else:
+            units.append((start, end, len(offsets)))
+
+    chunks, current = [], []
+    for unit in units:
+        if current and sum(tokens for _, _, tokens in current) + unit[2] > max_tokens:
+            chunks.append(current)
+            # Carry the last sentences over so context isn't lost at chunk edges
+            current = current[-overlap:] if overlap else []
+            while current and sum(tokens for _, _, tokens in current) + unit[2] > max_tokens:
+                current = current[1:]
+        current.append(unit)
+    if current:
+        chunks.append(current)
+
+    return [
+        {"text": text[group[0][0]:group[-1][1]], "page": page, "start": group[0][0], "end": group[-1][1]}
+        for group in chunks
+    ]
+
+
+def chunk_pages(pages: Iterable[Tuple[int, str]], tokenizer, max_tokens: int = CHUNK_MAX_TOKENS,
+                overlap: int = CHUNK_OVERLAP_SENTENCES) -> Iterator[dict]:
+    """Chunk (page_number, text) pairs one page at a time, so pages can be consumed as they are extracted."""
+    for page_number, page_text in pages:
+        yield from chunk_text(page_text, tokenizer, max_tokens, overlap, page=page_number)
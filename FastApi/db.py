@@ -1,5 +1,8 @@
 # db.py
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, uri_parser
+from pymongo.errors import OperationFailure
+from metrics import mongo_listener
 import os
 from dotenv import load_dotenv
 
@@ -7,16 +10,101 @@ load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI")
 
-try:
-    # Attempt to connect to MongoDB
-    client = MongoClient(MONGO_URI)
-    # Check the connection by calling the 'server_info' method
-    client.server_info()  # This will raise an exception if the connection fails
-    db = client.get_database()  # If connection is successful, access the database
-    print("MongoDB connection successful!")
-except Exception as e:
-    # If there's an error, print the error message
-    print(f"MongoDB connection failed: {e}")
+# Connection pool and timeouts (milliseconds)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+
+# Indexes ensured at startup: collection -> list of (keys, options)
+INDEXES = {
+    "users": [
+        ([("email", ASCENDING)], {"unique": True}),
+    ],
+    "chats": [
+        ([("user_id", ASCENDING), ("timestamp", DESCENDING)], {}),
+        ([("document_hash", ASCENDING)], {}),
+        ([("last_active", DESCENDING)], {}),
+    ],
+    "messages": [
+        ([("chat_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+    ],
+    "outbox": [
+        ([("status", ASCENDING), ("next_attempt_at", ASCENDING)], {}),
+    ],
+}
+
+client = None
+db = None
+
+
+def create_client(uri: str = MONGO_URI):
+    # "mongomock://" runs against an in-memory stand-in (mongomock-motor, in requirements-optional.txt)
+    if uri and uri.startswith("mongomock://"):
+        from mongomock_motor import AsyncMongoMockClient
+        return AsyncMongoMockClient()
+
+    return AsyncIOMotorClient(
+        uri,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        event_listeners=[mongo_listener],  # per-command latency histograms on /metrics
+    )
+
+
+def _database_name(uri: str) -> str:
+    # The database named in the URI, like MongoClient.get_database() used to pick
+    if uri and not uri.startswith("mongomock://"):
+        name = uri_parser.parse_uri(uri).get("database")
+        if name:
+            return name
+    return "docgenius"
+
+
+async def connect(uri: str = MONGO_URI, database: str = None):
+    """Open the pooled client (once per process) and make sure the indexes exist."""
+    global client, db
+    if db is not None:
+        return db
+
+    client = create_client(uri)
+    try:
+        # Check the connection by calling the 'server_info' method
+        await client.server_info()
+        db = client.get_database(database or _database_name(uri))
+        print("MongoDB connection successful!")
+    except Exception as e:
+        # If there's an error, print the error message
+        print(f"MongoDB connection failed: {e}")
+        raise
+
+    await ensure_indexes(db)
+    return db
+
+
+async def ensure_indexes(database):
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await database[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                # e.g. duplicate emails already stored; keep serving and report it
+                print(f"Could not create index {keys} on {collection}: {e}")
+
+
+async def close():
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
+
 
 def get_db():
+    if db is None:
+        raise RuntimeError("Database not connected; call db.connect() at startup")
     return db
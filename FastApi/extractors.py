@@ -0,0 +1,80 @@
+# extractors.py
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+import PyPDF2
+from docx import Document
+from bs4 import BeautifulSoup
+
+SUPPORTED_EXTENSIONS = ("pdf", "docx", "html", "txt")
+
+# PDFs with at least this many pages are split into page ranges and extracted on a process pool
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "20"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0")) or os.cpu_count()
+
+_pdf_pool = None
+
+
+def _get_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is None:
+        # spawn so the workers don't inherit the models and threads of the API process
+        _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_pool
+
+
+def _extract_pdf_range(path: str, start: int, end: int) -> List[str]:
+    reader = PyPDF2.PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+# Yields (page_number, text) for each PDF page, in order, as soon as it is available
+def iter_pdf_pages(path: str) -> Iterator[Tuple[int, str]]:
+    reader = PyPDF2.PdfReader(path)
+    page_count = len(reader.pages)
+
+    if page_count < PDF_PARALLEL_MIN_PAGES:
+        for page_number, page in enumerate(reader.pages, start=1):
+            yield page_number, page.extract_text() or ""
+        return
+
+    # Fan page ranges out to the pool (each worker opens the file itself) and hand them back in page order
+    pool = _get_pdf_pool()
+    starts = range(0, page_count, PDF_PAGES_PER_TASK)
+    futures = [
+        pool.submit(_extract_pdf_range, path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+        for start in starts
+    ]
+    for start, future in zip(starts, futures):
+        for offset, text in enumerate(future.result()):
+            yield start + offset + 1, text
+
+# Function to extract text from DOCX using python-docx
+def extract_text_from_docx(path: str) -> str:
+    doc = Document(path)
+    return "\n".join(para.text for para in doc.paragraphs)
+
+# Function to extract text from HTML using BeautifulSoup
+def extract_text_from_html(path: str) -> str:
+    with open(path, "rb") as f:
+        soup = BeautifulSoup(f, "html.parser")
+    return soup.get_text()
+
+def iter_pages(path: str, file_extension: str) -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) pairs from a file on disk; formats without pages are a single page 1."""
+    if file_extension == "pdf":
+        yield from iter_pdf_pages(path)
+    elif file_extension == "docx":
+        yield 1, extract_text_from_docx(path)
+    elif file_extension == "html":
+        yield 1, extract_text_from_html(path)
+    elif file_extension == "txt":
+        with open(path, encoding="utf-8") as f:
+            yield 1, f.read()
+    else:
+        raise ValueError(f"Unsupported file format: {file_extension}")
+
+def extract_text(path: str, file_extension: str) -> str:
+    return "\n".join(text for _, text in iter_pages(path, file_extension))
@@ -0,0 +1,96 @@
+# index_report.py
+# Measures recall@k and per-query latency of the approximate index types against exact search,
+# to pick INDEX_IVF_MIN_VECTORS / INDEX_HNSW_MIN_VECTORS and the nprobe / efSearch values.
+#
+#   python index_report.py --chat-id <id> [--queries 200] [--k 3]
+#   python index_report.py --synthetic 100000 [--dim 384]
+import argparse
+import asyncio
+import time
+import numpy as np
+from bson import ObjectId
+from utils import normalize_vectors, make_faiss_index, unpack_embeddings
+
+NPROBE_VALUES = [1, 4, 8, 16, 32, 64]
+EF_SEARCH_VALUES = [16, 32, 64, 128, 256]
+
+
+async def load_chat_vectors(chat_id: str):
+    import db
+    database = await db.connect()
+    projection = {"embeddings": 1, "embedding_dtype": 1, "embedding_dim": 1, "document_hash": 1}
+    chat = await database.chats.find_one({"_id": ObjectId(chat_id)}, projection)
+    if chat and chat.get("document_hash"):
+        # Deduplicated chats keep their embeddings on the shared document
+        chat = await database.documents.find_one({"_id": chat["document_hash"]}, projection)
+    await db.close()
+    if not chat:
+        raise SystemExit(f"Chat {chat_id} not found")
+    return unpack_embeddings(chat)
+
+
+def timed_search(index, queries, k):
+    start = time.perf_counter()
+    _, indices = index.search(queries, k)
+    return indices, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def recall(found, expected):
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found, expected))
+    return hits / expected.size
+
+
+def recall_report(vectors, query_count: int = 200, k: int = 3, seed: int = 0):
+    """Return one row per (index type, search parameter) with recall@k against exact search and latency."""
+    rng = np.random.default_rng(seed)
+    vectors = normalize_vectors(vectors)
+    # Queries are stored vectors with a little noise, like questions phrased close to the text
+    picks = rng.choice(len(vectors), size=min(query_count, len(vectors)), replace=False)
+    queries = normalize_vectors(vectors[picks] + rng.normal(scale=0.05, size=vectors[picks].shape))
+
+    rows = []
+    start = time.perf_counter()
+    exact = make_faiss_index(vectors, "flat")
+    build_ms = (time.perf_counter() - start) * 1000
+    expected, latency = timed_search(exact, queries, k)
+    rows.append({"index": "flat", "param": "-", "build_ms": build_ms, "recall": 1.0, "query_ms": latency})
+
+    for index_type, param_name, values in (("ivf", "nprobe", NPROBE_VALUES), ("hnsw", "efSearch", EF_SEARCH_VALUES)):
+        start = time.perf_counter()
+        index = make_faiss_index(vectors, index_type)
+        build_ms = (time.perf_counter() - start) * 1000
+        for value in values:
+            if index_type == "ivf":
+                index.nprobe = value
+            else:
+                index.hnsw.efSearch = value
+            found, latency = timed_search(index, queries, k)
+            rows.append({
+                "index": index_type,
+                "param": f"{param_name}={value}",
+                "build_ms": build_ms,
+                "recall": recall(found, expected),
+                "query_ms": latency,
+            })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall vs latency of FAISS index types")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--chat-id", help="Use the embeddings stored on this chat")
+    source.add_argument("--synthetic", type=int, help="Use this many random vectors")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.chat_id:
+        vectors = asyncio.run(load_chat_vectors(args.chat_id))
+    else:
+        vectors = np.random.default_rng(1).normal(size=(args.synthetic, args.dim)).astype("float32")
+
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, {args.queries} queries, recall@{args.k}")
+    print(f"{'index':<6} {'param':<14} {'build ms':>10} {'recall':>8} {'ms/query':>10}")
+    for row in recall_report(vectors, query_count=args.queries, k=args.k):
+        print(f"{row['index']:<6} {row['param']:<14} {row['build_ms']:>10.1f} {row['recall']:>8.3f} {row['query_ms']:>10.4f}")
@@ -0,0 +1,108 @@
+# index_store.py
+import glob
+import hashlib
+import os
+import faiss
+import numpy as np
+from utils import build_faiss_index, choose_index_type, INDEX_IVF_NPROBE, INDEX_HNSW_EF_SEARCH
+
+# Directory (local or a shared mount) holding one serialized FAISS index per document or legacy chat
+INDEX_DIRECTORY = os.getenv("INDEX_DIRECTORY", "indexes")
+# Open stored indexes with mmap so vectors are paged in on demand and shared between workers
+INDEX_MMAP = os.getenv("INDEX_MMAP", "true").lower() == "true"
+# Most recently active chats whose indexes are loaded at startup (0 disables the warm-up)
+INDEX_WARMUP_CHATS = int(os.getenv("INDEX_WARMUP_CHATS", "0"))
+
+
+def index_version(packed: dict) -> str:
+    """Version of the index built from a packed embeddings blob.
+
+    Derived from the stored vectors and the index type they select, so a file is only reused
+    while it matches the embeddings on record (e.g. not after migrate_embeddings changes them).
+    """
+    embeddings = packed.get("embeddings")
+    if not isinstance(embeddings, bytes) or not embeddings:
+        return None  # legacy list layout: always built from Mongo until migrated
+    itemsize = np.dtype(packed.get("embedding_dtype", "float32")).itemsize
+    index_type = choose_index_type(len(embeddings) // (packed["embedding_dim"] * itemsize))
+    digest = hashlib.sha1(embeddings)
+    digest.update(index_type.encode())
+    return digest.hexdigest()[:16]
+
+
+def index_path(key: str, version: str) -> str:
+    return os.path.join(INDEX_DIRECTORY, f"{key}-{version}.faiss")
+
+
+def save_index(index, key: str, version: str):
+    """Write the index atomically and drop files of older versions."""
+    os.makedirs(INDEX_DIRECTORY, exist_ok=True)
+    path = index_path(key, version)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+    for old_path in glob.glob(os.path.join(INDEX_DIRECTORY, f"{key}-*.faiss")):
+        if old_path != path:
+            remove_file(old_path)
+
+
+def mmap_flags(path: str) -> int:
+    """FAISS read flags that map the stored vectors instead of copying them into memory.
+
+    IO_FLAG_MMAP only maps on-disk IVF inverted lists, flat and HNSW files are still read in full;
+    their vectors are mapped by IO_FLAG_MMAP_IFC. The two don't combine, so the file's index type
+    (its FAISS fourcc, "Iw.." for IVF) picks one.
+    """
+    with open(path, "rb") as f:
+        fourcc = f.read(4)
+    if fourcc.startswith(b"Iw"):
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    return faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+
+
+def load_index(key: str, version: str):
+    """(index, mapped) for the stored index of this version, or (None, False) if there is none.
+
+    `mapped` tells whether the vectors stay in the page cache (shared by workers) instead of process memory.
+    """
+    if not version:
+        return None, False
+    path = index_path(key, version)
+    if not os.path.exists(path):
+        return None, False
+    try:
+        if not INDEX_MMAP:
+            raise RuntimeError("mmap disabled")
+        index, mapped = faiss.read_index(path, mmap_flags(path)), True
+    except (RuntimeError, OSError):
+        # Index types without mmap support (or a damaged file) fall back to a normal read / rebuild
+        try:
+            index, mapped = faiss.read_index(path), False
+        except RuntimeError:
+            return None, False
+    # Search-time knobs follow the current configuration, not the one the file was written with
+    if hasattr(index, "nprobe"):
+        index.nprobe = INDEX_IVF_NPROBE
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = INDEX_HNSW_EF_SEARCH
+    return index, mapped
+
+
+def build_and_save(vectors, key: str, version: str):
+    """Build the FAISS index for a document's embeddings and persist it (when it has a version)."""
+    index = build_faiss_index(vectors)
+    if version:
+        save_index(index, key, version)
+    return index
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def remove_indexes(key: str):
+    for path in glob.glob(os.path.join(INDEX_DIRECTORY, f"{key}-*.faiss")):
+        remove_file(path)
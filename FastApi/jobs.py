@@ -0,0 +1,224 @@
+# jobs.py
+import asyncio
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from extractors import iter_pages
+from services import set_document_status, renew_document_leases, DOCUMENT_LEASE_SECONDS, process_document, extract_document, encode_chunks, document_fields
+from storage import get_storage
+from index_store import index_version, build_and_save
+from utils import unpack_embeddings
+from metrics import span, document_labels
+
+# Ingestion runs on a bounded thread pool so parsing and inference never block the event loop.
+# Threads (not processes) so every job shares the single model copy held by model_registry.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "20"))
+
+# Blob uploads are network-bound and run next to extraction instead of before it
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+
+# Files accepted by one bulk upload; a bulk upload is queued as a single job
+INGEST_BULK_MAX_FILES = int(os.getenv("INGEST_BULK_MAX_FILES", "50"))
+
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")
+_pending = 0  # queued or running jobs; only touched on the event loop
+_tasks = set()  # keeps running jobs referenced until they finish
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+async def keep_leases(content_hashes):
+    """Renew the documents' leases for as long as their job runs (cancelled when it ends)."""
+    while True:
+        await asyncio.sleep(DOCUMENT_LEASE_SECONDS / 3)
+        try:
+            await renew_document_leases(content_hashes)
+        except Exception as e:
+            print(f"Could not renew document leases: {e}")
+
+
+async def run_ingestion(content_hash: str, path: str, file_extension: str, blob_name: str):
+    global _pending
+    loop = asyncio.get_running_loop()
+    stage_updates = []
+    labels = document_labels(file_extension, os.path.getsize(path) // 1024)
+
+    def upload():
+        with span("upload", labels):
+            get_storage().upload_file(blob_name, path)
+
+    def ingest():
+        fields = process_document(iter_pages(path, file_extension), on_stage, labels)
+        # Persist the FAISS index now, so the first question doesn't have to build it
+        version = index_version(fields)
+        if version:
+            with span("index_build", labels):
+                build_and_save(unpack_embeddings(fields), content_hash, version)
+        return {**fields, "index_version": version}
+
+    def on_stage(stage: str):
+        # Called from the worker thread; the status write happens on the event loop
+        stage_updates.append(asyncio.run_coroutine_threadsafe(set_document_status(content_hash, stage), loop))
+
+    heartbeat = asyncio.create_task(keep_leases([content_hash]))
+    try:
+        await set_document_status(content_hash, "extracting")
+
+        # Upload the spooled file while its pages are extracted, chunked and encoded. Both read the
+        # file, so wait for both even if one fails: it is deleted once the job ends
+        with span("ingestion", labels):
+            uploaded, fields = await asyncio.gather(
+                loop.run_in_executor(upload_executor, upload),
+                loop.run_in_executor(ingest_executor, ingest),
+                return_exceptions=True,
+            )
+        for outcome in (uploaded, fields):
+            if isinstance(outcome, Exception):
+                raise outcome
+        # Let the intermediate status writes land before the final one
+        await asyncio.gather(*(asyncio.wrap_future(update) for update in stage_updates))
+        await set_document_status(content_hash, "done", **fields)
+    except Exception as e:
+        traceback.print_exc()
+        await asyncio.gather(*(asyncio.wrap_future(update) for update in stage_updates), return_exceptions=True)
+        await set_document_status(content_hash, "failed", error=str(e))
+    finally:
+        heartbeat.cancel()
+        _pending -= 1
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+async def run_bulk_ingestion(documents):
+    """Ingest several spooled uploads as one job; `documents` holds (content_hash, path, file_extension, blob_name).
+
+    The documents are extracted in parallel, the chunks of all of them are encoded together in large
+    batches, then each one is summarized and indexed. A document that fails doesn't fail the others.
+    """
+    global _pending
+    loop = asyncio.get_running_loop()
+    hashes = [content_hash for content_hash, *_ in documents]
+    labels = {
+        content_hash: document_labels(file_extension, os.path.getsize(path) // 1024)
+        for content_hash, path, file_extension, _ in documents
+    }
+    bulk_labels = document_labels("bulk", sum(os.path.getsize(path) for _, path, _, _ in documents) // 1024)
+    errors, results = {}, {}
+
+    def upload(path: str, blob_name: str, labels: dict):
+        with span("upload", labels):
+            get_storage().upload_file(blob_name, path)
+
+    def extract(path: str, file_extension: str, labels: dict):
+        return extract_document(iter_pages(path, file_extension), labels)
+
+    def finish(content_hash: str, extracted, vectors, labels: dict):
+        fields = document_fields(*extracted, vectors, labels)
+        version = index_version(fields)
+        if version:
+            with span("index_build", labels):
+                build_and_save(unpack_embeddings(fields), content_hash, version)
+        return {**fields, "index_version": version}
+
+    async def set_status(hashes, status: str):
+        await asyncio.gather(*(set_document_status(content_hash, status) for content_hash in hashes))
+
+    def collect(hashes, outcomes):
+        # Split gathered outcomes into results and per-document errors
+        for content_hash, outcome in zip(hashes, outcomes):
+            if isinstance(outcome, Exception):
+                errors.setdefault(content_hash, outcome)
+            else:
+                results[content_hash] = outcome
+
+    # Uploads run next to the whole pipeline, like in run_ingestion
+    uploads = asyncio.gather(*(
+        loop.run_in_executor(upload_executor, upload, path, blob_name, labels[content_hash])
+        for content_hash, path, _, blob_name in documents
+    ), return_exceptions=True)
+    heartbeat = asyncio.create_task(keep_leases(hashes))
+    try:
+        await set_status(hashes, "extracting")
+        with span("ingestion", bulk_labels):
+            extracted = await asyncio.gather(*(
+                loop.run_in_executor(ingest_executor, extract, path, file_extension, labels[content_hash])
+                for content_hash, path, file_extension, _ in documents
+            ), return_exceptions=True)
+            collect(hashes, extracted)
+
+            extracted = [(content_hash, results.pop(content_hash)) for content_hash in hashes if content_hash in results]
+            if extracted:
+                await set_status([content_hash for content_hash, _ in extracted], "embedding")
+                vectors = await loop.run_in_executor(
+                    ingest_executor, encode_chunks, [chunk_texts for _, (_, chunk_texts, _) in extracted], bulk_labels
+                )
+                await set_status([content_hash for content_hash, _ in extracted], "summarizing")
+                finished = await asyncio.gather(*(
+                    loop.run_in_executor(ingest_executor, finish, content_hash, document, document_vectors, labels[content_hash])
+                    for (content_hash, document), document_vectors in zip(extracted, vectors)
+                ), return_exceptions=True)
+                collect([content_hash for content_hash, _ in extracted], finished)
+
+            for content_hash, outcome in zip(hashes, await uploads):
+                if isinstance(outcome, Exception):
+                    errors.setdefault(content_hash, outcome)
+
+        for content_hash, fields in results.items():
+            if content_hash not in errors:
+                await set_document_status(content_hash, "done", **fields)
+    except Exception as e:
+        # e.g. the pooled encode failed: nothing in the batch finished
+        for content_hash in hashes:
+            errors.setdefault(content_hash, e)
+    finally:
+        heartbeat.cancel()
+        await uploads  # don't delete spool files that are still being uploaded
+        for content_hash, error in errors.items():
+            traceback.print_exception(type(error), error, error.__traceback__)
+            await set_document_status(content_hash, "failed", error=str(error))
+        _pending -= 1
+        for _, path, _, _ in documents:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def pending_jobs() -> int:
+    return _pending
+
+
+def submit_ingestion(content_hash: str, path: str, file_extension: str, blob_name: str):
+    """Queue a spooled upload for background ingestion into the shared document `content_hash`.
+
+    The job stores the file as `blob_name`, updates every chat on the document, and deletes `path`.
+    """
+    global _pending
+    if _pending >= INGEST_MAX_PENDING:
+        raise IngestQueueFull("Too many documents are being processed, try again shortly")
+    _pending += 1
+    task = asyncio.create_task(run_ingestion(content_hash, path, file_extension, blob_name))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+def submit_bulk_ingestion(documents):
+    """Queue several spooled uploads as one background job (see run_bulk_ingestion).
+
+    Counts as a single pending job: its documents share the ingest pool instead of each taking a slot.
+    """
+    global _pending
+    if _pending >= INGEST_MAX_PENDING:
+        raise IngestQueueFull("Too many documents are being processed, try again shortly")
+    _pending += 1
+    task = asyncio.create_task(run_bulk_ingestion(documents))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
@@ -1,27 +1,31 @@
 from bson import ObjectId
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from io import BytesIO
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Depends
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from datetime import datetime
-from services import create_user, authenticate_user, delete, generate_token, create_chat, send_message, verify_user
+from typing import List, Optional
+from services import active_generations, search_documents, warm_up_indexes, create_user, authenticate_user, delete, generate_token, create_chat, create_chats, claim_document, release_document, set_document_status, send_message, stream_message, verify_user, get_chat_status, fail_stale_documents, get_messages, MESSAGES_PAGE_SIZE, MESSAGES_MAX_PAGE_SIZE
 from schemas import UserSchema, ChatSchema, MessageSchema, LoginRequest
-from shutil import copyfileobj
+from cache import index_cache, answer_cache
+from user_index import user_indexes
+from index_store import INDEX_WARMUP_CHATS
+from model_registry import registry, MODEL_WARMUP
+from utils import query_batcher
+import db
 from fastapi.middleware.cors import CORSMiddleware
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
+from fastapi.concurrency import run_in_threadpool
+from fastapi.staticfiles import StaticFiles
 import os
-import PyPDF2
-from docx import Document
-from bs4 import BeautifulSoup
+import json
+import asyncio
+from extractors import SUPPORTED_EXTENSIONS
+from jobs import submit_ingestion, submit_bulk_ingestion, IngestQueueFull, pending_jobs, INGEST_BULK_MAX_FILES
+import metrics
+from auth import get_current_user, require_chat, principal_cache
+from outbox import outbox_worker, OUTBOX_WORKER
+from message_writer import message_writer
+from storage import get_storage, spool_upload, document_blob_name, STORAGE_BACKEND, UPLOAD_DIRECTORY
 
 app = FastAPI()
-UPLOAD_DIRECTORY = "public"
-
-# Azure Storage connection string (from the Azure portal)
-AZURE_CONNECTION_STRING = os.getenv("AZURE_CONNECTION_STRING")
-CONTAINER_NAME = "documents"  # Name of the Blob Container you created
-
-# Initialize the BlobServiceClient
-blob_service_client = BlobServiceClient.from_connection_string(AZURE_CONNECTION_STRING)
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,8 +35,52 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
-if not os.path.exists(UPLOAD_DIRECTORY):
-    os.makedirs(UPLOAD_DIRECTORY)
+if STORAGE_BACKEND == "local":
+    # Documents kept on local disk are served by the API itself
+    get_storage()
+    app.mount(f"/{UPLOAD_DIRECTORY}", StaticFiles(directory=UPLOAD_DIRECTORY), name="documents")
+
+@app.on_event("startup")
+async def connect_db():
+    # Opens the pooled MongoDB client and ensures the indexes
+    await db.connect()
+
+@app.on_event("startup")
+async def fail_interrupted_ingestions():
+    # Documents left mid-ingestion by a crashed worker would otherwise show as processing forever
+    failed = await fail_stale_documents()
+    if failed:
+        print(f"Marked {failed} interrupted document ingestions failed")
+
+@app.on_event("startup")
+def start_outbox():
+    # Sends queued emails (signup verification) in the background
+    if OUTBOX_WORKER:
+        outbox_worker.start()
+
+@app.on_event("shutdown")
+async def stop_outbox():
+    await outbox_worker.stop()
+
+@app.on_event("shutdown")
+async def close_db():
+    await db.close()
+
+@app.on_event("startup")
+def warm_up_models():
+    # Load MiniLM and BART before the first request instead of on it
+    if MODEL_WARMUP:
+        registry.warm_up()
+
+@app.on_event("startup")
+async def warm_up_chat_indexes():
+    # Open the indexes of the most recently active chats so a restart doesn't slow their next question
+    if INDEX_WARMUP_CHATS > 0:
+        await warm_up_indexes(INDEX_WARMUP_CHATS)
+
+@app.get("/models/stats")
+def model_stats():
+    return {"models": registry.stats(), "query_batcher": query_batcher.stats()}
 
 @app.post("/signup")
 async def signup(user: UserSchema):
@@ -41,129 +89,274 @@ async def signup(user: UserSchema):
     return {"message" : "check mail for varification"}
 
 @app.get("/verify/{token}")
-def verify(token: str):
-    user = verify_user(token);
+async def verify(token: str):
+    user = await verify_user(token);
     return JSONResponse(content={"token": token, "user": user})
 
 
 @app.post("/login")
-def login(login_data: LoginRequest):
-    user_data = authenticate_user(login_data.email, login_data.password)
+async def login(login_data: LoginRequest):
+    user_data = await authenticate_user(login_data.email, login_data.password)
     # return JSONResponse(content={"user": user_data})
     return user_data
 
-# Function to upload the file to Azure Blob Storage
-def upload_to_azure(file: UploadFile, user_id: str):
-    # Create a "folder" structure by including the user_id in the blob name
-    blob_name = f"{user_id}/{file.filename}"
-
-    # Get a blob client
-    blob_client = blob_service_client.get_blob_client(container=CONTAINER_NAME, blob=blob_name)
-    # Read file data and upload it to Azure Blob Storage
-    file_data = file.file.read()
-    
-    # Upload the file to the blob storage
-    try:
-        blob_client.upload_blob(file_data, overwrite=True)  # overwrite=True to overwrite if file exists
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
-    
-    # Generate the URL for the uploaded file
-    blob_url = f"https://{blob_service_client.account_name}.blob.core.windows.net/{CONTAINER_NAME}/{blob_name}"
-    
-    return blob_url
-
-# Function to extract text from PDF using PyPDF2
-def extract_text_from_pdf(file: UploadFile) -> str:
-    with file.file as f:  # Open the file
-        reader = PyPDF2.PdfReader(f)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-    return text
-
-# Function to extract text from DOCX using python-docx
-def extract_text_from_docx(file: UploadFile) -> str:
-    with file.file as f:
-        doc = Document(f)
-        text = ""
-        for para in doc.paragraphs:
-            text += para.text + "\n"
-    return text
-
-# Function to extract text from HTML using BeautifulSoup
-def extract_text_from_html(file: UploadFile) -> str:
-    with file.file as f:
-        soup = BeautifulSoup(f, "html.parser")
-        text = soup.get_text()
-    return text
+async def abandon_uploads(user_id: str, uploads, chats, error: Exception):
+    """Undo uploads that failed before their ingestion was queued.
+
+    `uploads` holds (path, content_hash, claim) per file, with `claim` the (document, owner) pair
+    from claim_document or None. Removes the spool files, fails the documents these uploads were
+    to ingest (so the next upload retries them) and drops the references they took.
+    """
+    for path, content_hash, claim in uploads:
+        if path and os.path.exists(path):
+            os.remove(path)
+        if claim and claim[1]:
+            await set_document_status(content_hash, "failed", error=str(error))
+    if chats:
+        # Deleting the placeholder chats releases their documents
+        for chat in chats:
+            await delete(chat_id=ObjectId(chat["_id"]), user_id=ObjectId(user_id))
+    else:
+        for _, content_hash, claim in uploads:
+            if claim:
+                await release_document(content_hash)
+
 
 @app.post("/chat/create")
 async def create_new_chat(
-    user_id: str = Form(...),
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    user: dict = Depends(get_current_user),
 ):
+    user_id = user["_id"]
+    file_extension = file.filename.split(".")[-1]
+    if file_extension not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Unsupported file format")
+
+    path = content_hash = claim = chat_data = None
     try:
-        content = await file.read()
-        file.seek(0)
+        # Stream the upload to a spool file in chunks instead of holding it in memory
+        path, content_hash = await run_in_threadpool(spool_upload, file.file, f".{file_extension}")
+        blob_name = document_blob_name(content_hash, file_extension)
+
+        # A file that was uploaded before reuses its stored blob, text, chunks, embeddings and summary
+        claim = await claim_document(content_hash, get_storage().url_for(blob_name), file_extension)
+        document, owner = claim
+        chat_data = await create_chat(
+            file_size=file.size,
+            file_extension=file_extension,
+            file_name=file.filename,
+            user_id=user_id,
+            document_path=document["document_path"],
+            content_hash=content_hash,
+            status=document["status"],
+            doc_summary=document.get("doc_summary"),
+        )
+
+        if not owner:
+            os.remove(path)
+            return chat_data
+
+        # Extraction, upload, embedding and summarization continue in the background;
+        # progress is reported by /chat/status/{chat_id}
+        submit_ingestion(content_hash, path, file_extension, blob_name)
+        return chat_data
+    except IngestQueueFull as e:
+        # The document was never queued: fail it so the next upload retries, and drop the placeholder chat
+        await abandon_uploads(user_id, [(path, content_hash, claim)], [chat_data] if chat_data else [], e)
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        await abandon_uploads(user_id, [(path, content_hash, claim)], [chat_data] if chat_data else [], e)
+        raise HTTPException(status_code=500, detail=f"Error creating chat: {str(e)}")
+
+
+@app.post("/chat/create/bulk")
+async def create_new_chats(
+    files: List[UploadFile] = File(...),
+    user: dict = Depends(get_current_user),
+):
+    # One chat per file; results come back in upload order with either the chat or an error
+    user_id = user["_id"]
+    if len(files) > INGEST_BULK_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {INGEST_BULK_MAX_FILES} files per upload")
+
+    results = [{"filename": file.filename} for file in files]
+    accepted = []
+    for position, file in enumerate(files):
         file_extension = file.filename.split(".")[-1]
-        # print('ayatoo ave se')
-        if file_extension == "pdf":
-            raw_text = extract_text_from_pdf(file)
-        elif file_extension == "docx":
-            raw_text = extract_text_from_docx(file)
-        elif file_extension == "html":
-            raw_text = extract_text_from_html(file)
-        elif file_extension == "txt":
-            # content = await file.read()
-            raw_text = content.decode('utf-8')
+        if file_extension not in SUPPORTED_EXTENSIONS:
+            results[position]["error"] = "Unsupported file format"
         else:
-            raise HTTPException(status_code=400, detail="Unsupported file format")
-        
+            accepted.append((position, file, file_extension))
+    if not accepted:
+        return {"results": results}
 
-        # .............
-        try:
-           #login for uploading file...
-           blob_client = blob_service_client.get_blob_client(container=CONTAINER_NAME, blob=f"{user_id}/{file.filename}")
-        #    contents = file.file.read()
-        #    file.file.seek(0)
-           blob_client.upload_blob(content,overwrite=True)
-           file_url =  f"https://{blob_service_client.account_name}.blob.core.windows.net/{CONTAINER_NAME}/{user_id}/{file.filename}"
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
+    spooled, claims, chats = [], [], []
+    try:
+        # Spool and hash all files in parallel
+        outcomes = await asyncio.gather(*(
+            run_in_threadpool(spool_upload, file.file, f".{file_extension}") for _, file, file_extension in accepted
+        ), return_exceptions=True)
+        for (position, _, _), outcome in zip(accepted, outcomes):
+            if isinstance(outcome, Exception):
+                results[position]["error"] = f"Error reading file: {outcome}"
+        spooled = [outcome for outcome in outcomes if not isinstance(outcome, Exception)]
+        accepted = [item for item, outcome in zip(accepted, outcomes) if not isinstance(outcome, Exception)]
+        if not accepted:
+            return {"results": results}
+        storage = get_storage()
 
-        
-        # print('working fine', raw_text)
-        file_size = file.size
+        # Claim each distinct file concurrently; repeats within the upload reference the first one
+        first, repeats = {}, []
+        for n, (_, content_hash) in enumerate(spooled):
+            if content_hash in first:
+                repeats.append(n)
+            else:
+                first[content_hash] = n
+        claims = [None] * len(accepted)
 
-        chat_data = await create_chat(file_size=file_size,file_extension=file_extension, user_id=user_id, document_path=file_url, raw_text=raw_text)
-        
-        # Return the created chat with its _id and the document path
-        return chat_data
+        async def claim(n):
+            _, _, file_extension = accepted[n]
+            content_hash = spooled[n][1]
+            claims[n] = await claim_document(content_hash, storage.url_for(document_blob_name(content_hash, file_extension)), file_extension)
+
+        await asyncio.gather(*(claim(n) for n in first.values()))
+        await asyncio.gather(*(claim(n) for n in repeats))
+
+        # All chats in one insert and one update of the user
+        chats = await create_chats(user_id, [{
+            "file_size": file.size,
+            "file_extension": file_extension,
+            "file_name": file.filename,
+            "document_path": document["document_path"],
+            "content_hash": content_hash,
+            "status": document["status"],
+            "doc_summary": document.get("doc_summary"),
+        } for (_, file, file_extension), (_, content_hash), (document, _) in zip(accepted, spooled, claims)])
+
+        owned = []
+        for (position, file, file_extension), (path, content_hash), (_, owner), chat in zip(accepted, spooled, claims, chats):
+            results[position]["chat"] = chat
+            if owner:
+                owned.append((content_hash, path, file_extension, document_blob_name(content_hash, file_extension)))
+            else:
+                os.remove(path)
+
+        # The new documents are extracted, encoded together and summarized in one background job
+        if owned:
+            submit_bulk_ingestion(owned)
+        return {"results": results}
+    except IngestQueueFull as e:
+        await abandon_uploads(user_id, bulk_uploads(spooled, claims), chats, e)
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error creating chat: {str(e)}")
+        await abandon_uploads(user_id, bulk_uploads(spooled, claims), chats, e)
+        raise HTTPException(status_code=500, detail=f"Error creating chats: {str(e)}")
+
+
+def bulk_uploads(spooled, claims):
+    # (path, content_hash, claim) per spooled file, for abandon_uploads
+    claims = claims + [None] * (len(spooled) - len(claims))
+    return [(path, content_hash, claim) for (path, content_hash), claim in zip(spooled, claims)]
+
+
+@app.get("/chat/status/{chat_id}")
+async def chat_status(chat_id: str, user: dict = Depends(get_current_user)):
+    if not ObjectId.is_valid(chat_id):
+        raise HTTPException(status_code=400, detail="Invalid chat ID")
+    await require_chat(user, chat_id)
+    return await get_chat_status(chat_id)
+
+
+@app.get("/chat/{chat_id}/messages")
+async def chat_messages(
+    chat_id: str,
+    before: Optional[str] = None,
+    limit: int = Query(MESSAGES_PAGE_SIZE, ge=1, le=MESSAGES_MAX_PAGE_SIZE),
+    user: dict = Depends(get_current_user),
+):
+    # Pass the previous page's next_before as `before` to load older messages
+    if not ObjectId.is_valid(chat_id):
+        raise HTTPException(status_code=400, detail="Invalid chat ID")
+    await require_chat(user, chat_id)
+    return await get_messages(chat_id, before=before, limit=limit)
 
 
 @app.post("/chat/message")
-def send_new_message( message: MessageSchema):
-    message_data = send_message(
+async def send_new_message(message: MessageSchema, user: dict = Depends(get_current_user)):
+    await require_chat(user, message.chat_id)
+    message_data = await send_message(
         chat_id=message.chat_id,
         text=message.text,
+        mode=message.mode,
     )
     return message_data
 
+@app.post("/chat/message/stream")
+async def send_new_message_stream(message: MessageSchema, user: dict = Depends(get_current_user)):
+    await require_chat(user, message.chat_id)
+    # Server-Sent Events: the retrieved sentences first, then the answer as it is generated,
+    # then the persisted message
+    async def events():
+        try:
+            async for event, data in stream_message(chat_id=message.chat_id, text=message.text, mode=message.mode):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except HTTPException as e:
+            yield f"event: error\ndata: {json.dumps({'message': e.detail})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'message': str(e)})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/search")
+async def search(
+    q: str = Query(..., min_length=1),
+    k: int = Query(5, ge=1, le=50),
+    user: dict = Depends(get_current_user),
+):
+    # Passages from all of the user's documents, best first
+    return await search_documents(user["_id"], q, k, chat_ids=user["chat_ids"])
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "index_cache": index_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "user_indexes": user_indexes.stats(),
+        "principal_cache": principal_cache.stats(),
+    }
+
+# Queue depths and cache counters are read from their stats() when /metrics is scraped
+metrics.register_stats("index_cache", index_cache.stats, gauges=("entries", "bytes", "hit_rate"), counters=("hits", "misses", "evictions"))
+metrics.register_stats("user_indexes", user_indexes.stats, gauges=("users", "vectors", "bytes", "hit_rate"), counters=("hits", "misses", "evictions", "expirations"))
+metrics.register_stats("answer_cache", answer_cache.stats, gauges=("entries", "hit_rate"), counters=("hits", "misses"))
+metrics.register_stats("query_batcher", query_batcher.stats, gauges=("queue_depth", "mean_batch_size"), counters=("batches", "items"))
+metrics.register_stats("principal_cache", principal_cache.stats, gauges=("users", "hit_rate"), counters=("hits", "misses"))
+metrics.register_stats("ingest", lambda: {"pending_jobs": pending_jobs()}, gauges=("pending_jobs",))
+metrics.register_stats("outbox", outbox_worker.stats, counters=("sent", "retried", "failed", "batches", "connections"))
+metrics.register_stats("message_writer", message_writer.stats, gauges=("queue_depth", "mean_batch_size"), counters=("batches", "items"))
+metrics.register_stats("answers", lambda: {"active_generations": active_generations()}, gauges=("active_generations",))
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.delete("/chat/delete")
-async def delete_chat(chat_id: str, user_id: str):
-    try:
-        # Ensure the chat_id is a valid ObjectId
-        if not ObjectId.is_valid(chat_id):
-            raise HTTPException(status_code=400, detail="Invalid chat ID")
+async def delete_chat(chat_id: str, user: dict = Depends(get_current_user)):
+    # Ensure the chat_id is a valid ObjectId and belongs to the caller
+    if not ObjectId.is_valid(chat_id):
+        raise HTTPException(status_code=400, detail="Invalid chat ID")
+    await require_chat(user, chat_id)
 
+    try:
         # Convert chat_id and user_id to ObjectId
         chat_id_obj = ObjectId(chat_id)
-        user_id_obj = ObjectId(user_id)
+        user_id_obj = ObjectId(user["_id"])
 
-        return delete(chat_id=chat_id_obj,user_id=user_id_obj)
+        return await delete(chat_id=chat_id_obj,user_id=user_id_obj)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting chat: {str(e)}")
@@ -0,0 +1,92 @@
+# message_writer.py
+import asyncio
+import os
+from bson import ObjectId
+from db import get_db
+
+# Latest messages kept inside each chat document (capped), so the conversation context and the
+# first history page come with the chat read instead of a query on `messages`
+CHAT_RECENT_MESSAGES = int(os.getenv("CHAT_RECENT_MESSAGES", "10"))
+# Most messages written by one group commit
+MESSAGE_WRITE_MAX_BATCH = int(os.getenv("MESSAGE_WRITE_MAX_BATCH", "100"))
+
+
+class MessageWriter:
+    """Group commit for chat messages.
+
+    Messages saved while a write is in flight queue up and go out together in the next one: a single
+    insert_many into `messages` plus one update per chat (pushing the ids and the capped recent
+    messages), sent concurrently. Every caller waits only for the write holding its message.
+    """
+
+    def __init__(self, max_batch_size: int = 100, recent_messages: int = 10):
+        self.max_batch_size = max_batch_size
+        self.recent_messages = recent_messages
+        self._pending = []
+        self._task = None
+        self.batches = 0
+        self.items = 0
+
+    async def write(self, chat_id: str, message: dict) -> dict:
+        """Store a message ({text, answer, timestamp}) on the chat and return it with its _id."""
+        message = {"_id": ObjectId(), **message}
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((chat_id, message, future))
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush())
+        await future
+        return message
+
+    async def _flush(self):
+        try:
+            while self._pending:
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+                try:
+                    await self._write(batch)
+                except Exception as e:
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_result(None)
+                self.batches += 1
+                self.items += len(batch)
+        finally:
+            self._task = None
+
+    async def _write(self, batch):
+        db = get_db()
+        by_chat = {}
+        for chat_id, message, _ in batch:
+            by_chat.setdefault(chat_id, []).append(message)
+
+        await asyncio.gather(
+            db.messages.insert_many([{**message, "chat_id": ObjectId(chat_id)} for chat_id, message, _ in batch], ordered=False),
+            *(
+                db.chats.update_one(
+                    {"_id": ObjectId(chat_id)},
+                    {
+                        "$push": {
+                            "message_ids": {"$each": [message["_id"] for message in messages]},
+                            "recent_messages": {"$each": messages, "$slice": -self.recent_messages},
+                        },
+                        "$set": {"last_active": messages[-1]["timestamp"]},
+                    },
+                )
+                for chat_id, messages in by_chat.items()
+            ),
+        )
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "queue_depth": len(self._pending),
+        }
+
+
+message_writer = MessageWriter(max_batch_size=MESSAGE_WRITE_MAX_BATCH, recent_messages=CHAT_RECENT_MESSAGES)
@@ -0,0 +1,115 @@
+# metrics.py
+# Stage timings, Mongo command latencies, queue depths and cache hit rates, exported in the
+# Prometheus text format on /metrics.
+import time
+import threading
+from contextlib import contextmanager
+from prometheus_client import Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from pymongo import monitoring
+
+# Stages last from milliseconds (search) to minutes (BART on a long document)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+# Upper bounds (KB) of the document size label
+SIZE_BUCKETS_KB = ((100, "lt_100kb"), (1024, "100kb_1mb"), (10 * 1024, "1mb_10mb"))
+
+stage_seconds = Histogram(
+    "docgenius_stage_seconds",
+    "Time spent in each ingestion and question-answering stage",
+    ["stage", "file_type", "size_bucket"],
+    buckets=STAGE_BUCKETS,
+)
+mongo_seconds = Histogram(
+    "docgenius_mongo_command_seconds",
+    "MongoDB command round trips",
+    ["command", "collection", "outcome"],
+    buckets=MONGO_BUCKETS,
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+def size_bucket(size_kb) -> str:
+    if size_kb is None:
+        return "unknown"
+    for limit, label in SIZE_BUCKETS_KB:
+        if size_kb < limit:
+            return label
+    return "gt_10mb"
+
+
+def document_labels(file_type: str = None, size_kb: int = None) -> dict:
+    return {"file_type": file_type or "unknown", "size_bucket": size_bucket(size_kb)}
+
+
+def observe_stage(stage: str, seconds: float, labels: dict = None):
+    stage_seconds.labels(stage=stage, **(labels or document_labels())).observe(seconds)
+
+
+@contextmanager
+def span(stage: str, labels: dict = None):
+    """Time the enclosed block as `stage` (failed attempts are recorded too)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, labels)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Records the duration of every command sent through the Mongo client."""
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        # The collection is only part of the started event's command document
+        collection = event.command.get(event.command_name)
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = (
+                collection if isinstance(collection, str) else "-"
+            )
+
+    def _finish(self, event, outcome: str):
+        with self._lock:
+            collection = self._collections.pop((event.connection_id, event.request_id), "-")
+        mongo_seconds.labels(command=event.command_name, collection=collection, outcome=outcome).observe(
+            event.duration_micros / 1e6
+        )
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+mongo_listener = MongoCommandListener()
+
+
+class StatsCollector:
+    """Exposes `stats()` dictionaries (caches, batchers, queues) as gauges and counters at scrape time."""
+
+    def __init__(self, name: str, stats, gauges=(), counters=()):
+        self.name = name
+        self.stats = stats
+        self.gauges = gauges
+        self.counters = counters
+
+    def collect(self):
+        stats = self.stats()
+        for field in self.gauges:
+            yield GaugeMetricFamily(f"docgenius_{self.name}_{field}", f"{self.name} {field}", value=stats[field])
+        for field in self.counters:
+            yield CounterMetricFamily(f"docgenius_{self.name}_{field}", f"{self.name} {field}", value=stats[field])
+
+
+def register_stats(name: str, stats, gauges=(), counters=()):
+    REGISTRY.register(StatsCollector(name, stats, gauges, counters))
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
@@ -0,0 +1,47 @@
+# migrate_embeddings.py
+# Converts chats that still store embeddings as BSON arrays into the packed binary layout.
+#
+#   python migrate_embeddings.py [--dtype float32|float16] [--batch-size 100] [--dry-run]
+import argparse
+import asyncio
+from pymongo import UpdateOne
+import db
+from utils import pack_embeddings, unpack_embeddings, EMBEDDING_STORAGE_DTYPE
+
+
+async def migrate(dtype: str = EMBEDDING_STORAGE_DTYPE, batch_size: int = 100, dry_run: bool = False) -> int:
+    database = await db.connect()
+    # Only legacy chats store the embeddings as an array
+    cursor = database.chats.find({"embeddings": {"$type": "array"}}, {"embeddings": 1})
+
+    migrated = 0
+    operations = []
+    async for chat in cursor:
+        packed = pack_embeddings(unpack_embeddings(chat), dtype=dtype)
+        # New embeddings, so any stored FAISS index is stale
+        operations.append(UpdateOne({"_id": chat["_id"]}, {"$set": packed, "$unset": {"index_version": ""}}))
+        migrated += 1
+
+        if len(operations) >= batch_size:
+            if not dry_run:
+                await database.chats.bulk_write(operations, ordered=False)
+            operations = []
+            print(f"Migrated {migrated} chats...")
+
+    if operations and not dry_run:
+        await database.chats.bulk_write(operations, ordered=False)
+
+    await db.close()
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack chat embeddings into binary float blobs")
+    parser.add_argument("--dtype", default=EMBEDDING_STORAGE_DTYPE, choices=["float32", "float16"])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    count = asyncio.run(migrate(dtype=args.dtype, batch_size=args.batch_size, dry_run=args.dry_run))
+    action = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{action} {count} chats to {args.dtype} binary embeddings")
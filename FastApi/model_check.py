@@ -0,0 +1,134 @@
+# model_check.py
+# Compares an inference backend against eager PyTorch on the same inputs before it is switched on:
+# embedding cosine similarity and top-k retrieval agreement for MiniLM, summary overlap for BART,
+# and the speedup of each.
+#
+#   python model_check.py --backend onnx [--texts document.txt] [--skip-summarizer]
+#   python model_check.py --backend torch-int8 --min-cosine 0.98
+import argparse
+import sys
+import time
+import numpy as np
+from model_registry import MODEL_BACKENDS, _load_embedding_model, _load_summarizer
+from chunking import sentence_spans
+from utils import normalize_vectors
+
+SAMPLE_TEXT = (
+    "The supplier shall deliver the goods within 30 days of receiving a written purchase order. "
+    "Invoices are payable within 45 days and late payments accrue interest at 1.5% per month. "
+    "Dr. Smith from the finance department approves every invoice above $10,000. "
+    "The warranty covers manufacturing defects for two years from the delivery date. "
+    "Either party may terminate the agreement with 90 days written notice. "
+    "Confidential information must not be disclosed to third parties during or after the term. "
+    "Disputes are settled by arbitration in the city where the customer has its head office. "
+    "The customer may audit the supplier's records once per calendar year. "
+    "Prices are fixed for the first year and may then rise by at most the inflation rate. "
+    "Support requests are answered within one business day by the service desk."
+)
+QUESTIONS = [
+    "When do invoices have to be paid?",
+    "Who approves large invoices?",
+    "How long is the warranty?",
+    "How can the contract be terminated?",
+    "What happens with disputes?",
+]
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def lcs_f1(a: str, b: str) -> float:
+    """ROUGE-L style F1 between two texts, on lower-cased words."""
+    x, y = a.lower().split(), b.lower().split()
+    if not x or not y:
+        return float(x == y)
+    previous = [0] * (len(y) + 1)
+    for word in x:
+        current = [0]
+        for j, other in enumerate(y, start=1):
+            current.append(previous[j - 1] + 1 if word == other else max(previous[j], current[j - 1]))
+        previous = current
+    lcs = previous[-1]
+    if lcs == 0:
+        return 0.0
+    precision, recall = lcs / len(y), lcs / len(x)
+    return 2 * precision * recall / (precision + recall)
+
+
+def check_embeddings(backend: str, sentences, k: int = 3):
+    reference_model, _ = _load_embedding_model("torch")
+    candidate_model, _ = _load_embedding_model(backend)
+
+    # Warm both up so one-time graph setup isn't counted
+    reference_model.encode(sentences[:2])
+    candidate_model.encode(sentences[:2])
+
+    reference, reference_seconds = timed(reference_model.encode, sentences)
+    candidate, candidate_seconds = timed(candidate_model.encode, sentences)
+    reference, candidate = normalize_vectors(reference), normalize_vectors(candidate)
+    cosine = np.sum(reference * candidate, axis=1)
+
+    # Would retrieval pick the same chunks for the sample questions?
+    k = min(k, len(sentences))
+    ref_top = np.argsort(-normalize_vectors(reference_model.encode(QUESTIONS)) @ reference.T, axis=1)[:, :k]
+    cand_top = np.argsort(-normalize_vectors(candidate_model.encode(QUESTIONS)) @ candidate.T, axis=1)[:, :k]
+    overlap = np.mean([len(set(r) & set(c)) / k for r, c in zip(ref_top, cand_top)])
+
+    return {
+        "mean_cosine": float(cosine.mean()),
+        "min_cosine": float(cosine.min()),
+        f"top{k}_overlap": float(overlap),
+        "speedup": reference_seconds / candidate_seconds if candidate_seconds else float("inf"),
+    }
+
+
+def check_summarizer(backend: str, text: str):
+    reference_model, _ = _load_summarizer("torch")
+    candidate_model, _ = _load_summarizer(backend)
+    options = {"max_length": 150, "min_length": 30, "do_sample": False, "truncation": True}
+
+    reference, reference_seconds = timed(reference_model, text, **options)
+    candidate, candidate_seconds = timed(candidate_model, text, **options)
+    return {
+        "rouge_l_f1": lcs_f1(reference[0]["summary_text"], candidate[0]["summary_text"]),
+        "speedup": reference_seconds / candidate_seconds if candidate_seconds else float("inf"),
+        "reference": reference[0]["summary_text"],
+        "candidate": candidate[0]["summary_text"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check an inference backend against PyTorch")
+    parser.add_argument("--backend", required=True, choices=[b for b in MODEL_BACKENDS if b != "torch"])
+    parser.add_argument("--texts", help="Text file to use instead of the built-in sample")
+    parser.add_argument("--skip-summarizer", action="store_true")
+    parser.add_argument("--min-cosine", type=float, default=0.98, help="Fail below this mean embedding cosine")
+    parser.add_argument("--min-rouge", type=float, default=0.6, help="Fail below this summary ROUGE-L F1")
+    args = parser.parse_args()
+
+    text = SAMPLE_TEXT
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            text = f.read()
+    sentences = [text[start:end] for start, end in sentence_spans(text)]
+
+    failed = False
+    embedding = check_embeddings(args.backend, sentences)
+    print(f"embedding ({len(sentences)} sentences): " + ", ".join(f"{key}={value:.4f}" for key, value in embedding.items()))
+    if embedding["mean_cosine"] < args.min_cosine:
+        print(f"FAIL embedding mean cosine {embedding['mean_cosine']:.4f} < {args.min_cosine}")
+        failed = True
+
+    if not args.skip_summarizer:
+        summary = check_summarizer(args.backend, text)
+        print(f"summarizer: rouge_l_f1={summary['rouge_l_f1']:.4f}, speedup={summary['speedup']:.2f}")
+        print(f"  torch:  {summary['reference']}")
+        print(f"  {args.backend}: {summary['candidate']}")
+        if summary["rouge_l_f1"] < args.min_rouge:
+            print(f"FAIL summary ROUGE-L F1 {summary['rouge_l_f1']:.4f} < {args.min_rouge}")
+            failed = True
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,192 @@
+# model_registry.py
+import os
+import shutil
+import tempfile
+import threading
+import time
+import torch
+from sentence_transformers import SentenceTransformer
+from transformers import pipeline
+
+# Model configuration (shared by services.py and utils.py)
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+SUMMARIZER_MODEL_NAME = os.getenv("SUMMARIZER_MODEL_NAME", "facebook/bart-large-cnn")
+MODEL_DEVICE = os.getenv("MODEL_DEVICE", "cpu")
+MODEL_NUM_THREADS = int(os.getenv("MODEL_NUM_THREADS", "0"))  # 0 keeps the torch default
+MODEL_DTYPE = os.getenv("MODEL_DTYPE", "float32")  # float32, float16 or bfloat16
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "false").lower() == "true"
+
+# Inference backend per model: "torch" (eager PyTorch), "torch-int8" (dynamically quantized Linear
+# layers, CPU only) or "onnx" (ONNX Runtime, needs optimum[onnxruntime] from requirements-optional.txt).
+# Check a backend's accuracy and speed against PyTorch with model_check.py before switching.
+MODEL_BACKENDS = ("torch", "torch-int8", "onnx")
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "torch")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", MODEL_BACKEND)
+SUMMARIZER_BACKEND = os.getenv("SUMMARIZER_BACKEND", MODEL_BACKEND)
+# ONNX file inside the embedding model repo, e.g. onnx/model_qint8_avx512_vnni.onnx for int8 weights
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE")
+# The summarizer is exported to ONNX once and loaded from here afterwards (one folder per model)
+SUMMARIZER_ONNX_DIR = os.getenv("SUMMARIZER_ONNX_DIR", "onnx")
+
+TORCH_DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+}
+
+if MODEL_NUM_THREADS > 0:
+    torch.set_num_threads(MODEL_NUM_THREADS)
+
+
+def _rss_bytes() -> int:
+    """Current resident set size of this process (Linux only, 0 elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _module_bytes(module) -> int:
+    """Memory held by a torch module's parameters and buffers (0 for ONNX Runtime sessions)."""
+    if not isinstance(module, torch.nn.Module):
+        return 0
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def _check_backend(backend: str):
+    if backend not in MODEL_BACKENDS:
+        raise ValueError(f"Unknown model backend '{backend}', expected one of {', '.join(MODEL_BACKENDS)}")
+    if backend != "torch" and MODEL_DEVICE != "cpu":
+        raise ValueError(f"The {backend} backend only runs on CPU (MODEL_DEVICE={MODEL_DEVICE})")
+
+
+def _quantize(module):
+    # int8 weights with activations quantized on the fly; only Linear layers, which dominate both models
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _load_embedding_model(backend: str = EMBEDDING_BACKEND):
+    _check_backend(backend)
+    if backend == "onnx":
+        model_kwargs = {"file_name": EMBEDDING_ONNX_FILE} if EMBEDDING_ONNX_FILE else {}
+        model = SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+        return model, None
+
+    dtype = torch.float32 if backend == "torch-int8" else TORCH_DTYPES[MODEL_DTYPE]
+    model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=MODEL_DEVICE, model_kwargs={"torch_dtype": dtype})
+    if backend == "torch-int8":
+        model = _quantize(model)
+    return model, model
+
+
+def _export_summarizer_onnx() -> str:
+    """Folder holding the ONNX export of the summarizer, exporting it first if there is none yet.
+
+    Exporting BART-large takes minutes and several GB of RAM, so it happens once per SUMMARIZER_ONNX_DIR
+    rather than at every worker start. The export is written next to its final place and renamed, so a
+    worker never sees a partial folder and concurrent first starts keep whichever finished first.
+    """
+    directory = os.path.join(SUMMARIZER_ONNX_DIR, SUMMARIZER_MODEL_NAME.replace("/", "--"))
+    if os.path.exists(os.path.join(directory, "config.json")):
+        return directory
+
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    from transformers import AutoTokenizer
+
+    os.makedirs(SUMMARIZER_ONNX_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=SUMMARIZER_ONNX_DIR, prefix=".export-")
+    try:
+        print(f"Exporting {SUMMARIZER_MODEL_NAME} to ONNX in {directory} (first start only)")
+        ORTModelForSeq2SeqLM.from_pretrained(SUMMARIZER_MODEL_NAME, export=True).save_pretrained(staging)
+        AutoTokenizer.from_pretrained(SUMMARIZER_MODEL_NAME).save_pretrained(staging)
+        try:
+            os.rename(staging, directory)
+        except OSError:
+            if not os.path.exists(os.path.join(directory, "config.json")):
+                raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return directory
+
+
+def _load_summarizer(backend: str = SUMMARIZER_BACKEND):
+    _check_backend(backend)
+    if backend == "onnx":
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        from transformers import AutoTokenizer
+
+        directory = _export_summarizer_onnx()
+        model = ORTModelForSeq2SeqLM.from_pretrained(directory)
+        tokenizer = AutoTokenizer.from_pretrained(directory)
+        summarizer = pipeline("summarization", model=model, tokenizer=tokenizer)
+        return summarizer, None
+
+    dtype = torch.float32 if backend == "torch-int8" else TORCH_DTYPES[MODEL_DTYPE]
+    summarizer = pipeline("summarization", model=SUMMARIZER_MODEL_NAME, device=MODEL_DEVICE, torch_dtype=dtype)
+    if backend == "torch-int8":
+        summarizer.model = _quantize(summarizer.model)
+    return summarizer, summarizer.model
+
+
+class ModelRegistry:
+    """Loads each model once per process, on first use or at an explicit warm-up."""
+
+    def __init__(self, loaders: dict, backends: dict = None):
+        self._loaders = loaders
+        self._backends = backends or {}
+        self._models = {}
+        self._stats = {}
+        self._locks = {name: threading.Lock() for name in loaders}
+
+    def get(self, name: str):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._locks[name]:
+            # Another thread may have finished loading while we waited for the lock
+            if name in self._models:
+                return self._models[name]
+
+            rss_before = _rss_bytes()
+            start = time.perf_counter()
+            model, module = self._loaders[name]()
+            load_seconds = time.perf_counter() - start
+
+            self._stats[name] = {
+                "load_seconds": round(load_seconds, 3),
+                "parameter_bytes": _module_bytes(module),
+                "rss_delta_bytes": max(_rss_bytes() - rss_before, 0),
+                "device": MODEL_DEVICE,
+                "dtype": MODEL_DTYPE,
+                "backend": self._backends.get(name, "torch"),
+            }
+            self._models[name] = model
+            print(f"Loaded model '{name}' in {load_seconds:.2f}s")
+            return model
+
+    def warm_up(self, names=None):
+        for name in names or self._loaders:
+            self.get(name)
+
+    def stats(self) -> dict:
+        return {
+            name: {"loaded": name in self._models, **self._stats.get(name, {})}
+            for name in self._loaders
+        }
+
+
+registry = ModelRegistry(
+    {"embedding": _load_embedding_model, "summarizer": _load_summarizer},
+    backends={"embedding": EMBEDDING_BACKEND, "summarizer": SUMMARIZER_BACKEND},
+)
+
+
+def get_embedding_model():
+    return registry.get("embedding")
+
+
+def get_summarizer():
+    return registry.get("summarizer")
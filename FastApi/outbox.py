@@ -0,0 +1,252 @@
+# outbox.py
+# Outgoing email is written to the "outbox" collection and sent by a background worker, so
+# requests never wait for SMTP. The worker claims due messages in batches, sends them over one
+# SMTP connection that stays open between batches, and retries failures with exponential backoff.
+#
+# Any SMTP server works; to try it locally run a sink such as
+#   python -m aiosmtpd -n -l localhost:1025
+# with MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_STARTTLS=false and MAIL_USERNAME unset.
+import asyncio
+import os
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+import aiosmtplib
+from pymongo import ReturnDocument
+from dotenv import load_dotenv
+from db import get_db
+
+load_dotenv()
+
+# SMTP server (defaults match the Gmail account the project started with)
+MAIL_SERVER = os.getenv("MAIL_SERVER", "smtp.gmail.com")
+MAIL_PORT = int(os.getenv("MAIL_PORT", "587"))
+MAIL_STARTTLS = os.getenv("MAIL_STARTTLS", "true").lower() == "true"
+MAIL_SSL_TLS = os.getenv("MAIL_SSL_TLS", "false").lower() == "true"
+MAIL_USERNAME = os.getenv("MAIL_USERNAME") or None
+MAIL_PASSWORD = os.getenv("MAIL_PASSWORD") or None
+MAIL_FROM = os.getenv("MAIL_FROM") or f"DocGenius AI <{MAIL_USERNAME or 'noreply@localhost'}>"
+MAIL_TIMEOUT_SECONDS = float(os.getenv("MAIL_TIMEOUT_SECONDS", "30"))
+
+# Run the sender in this process (claims are atomic, so several API workers can all run one)
+OUTBOX_WORKER = os.getenv("OUTBOX_WORKER", "true").lower() == "true"
+# Messages claimed and sent per batch, and how often to look for due messages when idle
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+# Retries: attempts before a message is marked failed, first delay (doubled per attempt) and cap
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "30"))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "3600"))
+# A claimed message that isn't finished within this time (worker died) is picked up again
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+# Close the SMTP connection after this long without mail
+OUTBOX_IDLE_CLOSE_SECONDS = float(os.getenv("OUTBOX_IDLE_CLOSE_SECONDS", "60"))
+
+
+def backoff_seconds(attempts: int) -> float:
+    return min(OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF_SECONDS)
+
+
+def is_permanent(error: Exception) -> bool:
+    """5xx replies (bad address, rejected content) won't succeed on a retry."""
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(500 <= e.code < 600 for e in error.recipients)
+    if isinstance(error, aiosmtplib.SMTPAuthenticationError):
+        return False  # fixed by correcting the credentials, keep the mail until then
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return 500 <= error.code < 600
+    return False
+
+
+async def enqueue_email(to: str, subject: str, html: str):
+    """Store a message for the worker to send and wake it up."""
+    now = datetime.utcnow()
+    await get_db().outbox.insert_one({
+        "to": to,
+        "subject": subject,
+        "html": html,
+        "status": "pending",
+        "attempts": 0,
+        "created_at": now,
+        "next_attempt_at": now,
+    })
+    outbox_worker.wake()
+
+
+class OutboxWorker:
+    """Sends due outbox messages in batches over a reused SMTP connection."""
+
+    def __init__(self):
+        self._task = None
+        self._wakeup = None
+        self._smtp = None
+        self._last_used = 0.0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+        self.connections = 0
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._disconnect()
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                sent = await self.send_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # e.g. Mongo unavailable: keep the worker alive and try again on the next poll
+                print(f"Outbox batch failed: {e}")
+                sent = 0
+            if sent:
+                continue  # more may be due
+            if self._smtp is not None and asyncio.get_running_loop().time() - self._last_used > OUTBOX_IDLE_CLOSE_SECONDS:
+                await self._disconnect()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _claim(self, limit: int):
+        """Atomically take up to `limit` due messages (pending, retry-due or with an expired lease)."""
+        outbox = get_db().outbox
+        now = datetime.utcnow()
+        claimed = []
+        for _ in range(limit):
+            message = await outbox.find_one_and_update(
+                {"status": {"$in": ["pending", "sending"]}, "next_attempt_at": {"$lte": now}},
+                {"$set": {"status": "sending", "next_attempt_at": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)},
+                 "$inc": {"attempts": 1}},
+                sort=[("next_attempt_at", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if message is None:
+                break
+            claimed.append(message)
+        return claimed
+
+    async def send_due(self) -> int:
+        """Send one batch; returns the number of messages claimed."""
+        messages = await self._claim(OUTBOX_BATCH_SIZE)
+        if not messages:
+            return 0
+        self.batches += 1
+
+        sent_ids = []
+        outbox = get_db().outbox
+        unavailable = None
+        for message in messages:
+            error = unavailable
+            if unavailable is None:
+                try:
+                    error = await self._send(message)
+                except (aiosmtplib.SMTPException, OSError) as e:
+                    # Server unreachable or refusing the login: retry the rest of the batch later
+                    error = unavailable = e
+            if error is None:
+                sent_ids.append(message["_id"])
+            elif is_permanent(error) or message["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                self.failed += 1
+                print(f"Giving up on email to {message['to']} after {message['attempts']} attempts: {error}")
+                await outbox.update_one({"_id": message["_id"]}, {
+                    "$set": {"status": "failed", "last_error": str(error)},
+                    "$unset": {"next_attempt_at": ""},
+                })
+            else:
+                self.retried += 1
+                retry_at = datetime.utcnow() + timedelta(seconds=backoff_seconds(message["attempts"]))
+                await outbox.update_one({"_id": message["_id"]}, {
+                    "$set": {"status": "pending", "next_attempt_at": retry_at, "last_error": str(error)},
+                })
+
+        if sent_ids:
+            # One round trip marks every delivered message of the batch
+            self.sent += len(sent_ids)
+            await outbox.update_many({"_id": {"$in": sent_ids}}, {
+                "$set": {"status": "sent", "sent_at": datetime.utcnow()},
+                "$unset": {"next_attempt_at": "", "last_error": ""},
+            })
+        return len(messages)
+
+    async def _send(self, message):
+        """Send one message, reconnecting once if the kept-open connection has gone stale.
+
+        Returns the error for a message the server rejected; raises if the server can't be reached.
+        """
+        email = EmailMessage()
+        email["From"] = MAIL_FROM
+        email["To"] = message["to"]
+        email["Subject"] = message["subject"]
+        email.set_content(message["html"], subtype="html")
+
+        for attempt in range(2):
+            smtp = await self._connection()
+            try:
+                await smtp.send_message(email)
+                self._last_used = asyncio.get_running_loop().time()
+                return None
+            except (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPTimeoutError, OSError):
+                await self._disconnect()
+                if attempt == 1:
+                    raise
+            except aiosmtplib.SMTPException as e:
+                return e  # refused by the server: this message only
+
+    async def _connection(self):
+        if self._smtp is None or not self._smtp.is_connected:
+            smtp = aiosmtplib.SMTP(
+                hostname=MAIL_SERVER,
+                port=MAIL_PORT,
+                use_tls=MAIL_SSL_TLS,
+                start_tls=MAIL_STARTTLS,
+                username=MAIL_USERNAME,
+                password=MAIL_PASSWORD,
+                timeout=MAIL_TIMEOUT_SECONDS,
+            )
+            try:
+                await smtp.connect()  # includes STARTTLS and login
+            except (aiosmtplib.SMTPException, OSError):
+                smtp.close()
+                raise
+            self._smtp = smtp
+            self.connections += 1
+        return self._smtp
+
+    async def _disconnect(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            await smtp.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            smtp.close()
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "batches": self.batches,
+            "connections": self.connections,
+        }
+
+
+outbox_worker = OutboxWorker()
@@ -1,6 +1,6 @@
 # schema.py
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 from bson import ObjectId
 from fastapi import UploadFile
@@ -32,6 +32,8 @@ class ChatSchema(BaseModel):
 class MessageSchema(BaseModel):
     text: str
     chat_id: str
+    # extractive, abstractive or auto; ANSWER_MODE_DEFAULT when omitted
+    mode: Optional[Literal["extractive", "abstractive", "auto"]] = None
 
     class Config:
         orm_mode = True
@@ -1,39 +1,63 @@
 from fastapi import HTTPException, status, UploadFile
-from sentence_transformers import SentenceTransformer
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
 from db import get_db
 from models import User, Chat, Message
-from auth import hash_password, verify_password, create_access_token, verify_token
+from auth import hash_password_async, verify_password_async, create_access_token, verify_token, principal_cache, load_principal, VERIFY_TOKEN
 from bson import ObjectId
-from datetime import datetime
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from datetime import datetime, timedelta
 import os
+import numpy as np
 from dotenv import load_dotenv
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
-from transformers import pipeline
 from typing import List
-from utils import embed_text, build_faiss_index, search_faiss, structure_response
-
-# Initialize the Hugging Face summarizer pipeline
-summarizer = pipeline("summarization", model="facebook/bart-large-cnn")
-embedding_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+from utils import embed_text, embed_texts, search_faiss, structure_response, stream_response, extractive_response, pack_embeddings, unpack_embeddings
+from cache import index_cache, answer_cache, index_nbytes, DocumentIndex
+from user_index import UserIndex, user_indexes
+from index_store import index_version, load_index, build_and_save, remove_indexes
+from model_registry import get_embedding_model, get_summarizer
+from chunking import chunk_text, chunk_pages
+from metrics import span, observe_stage, document_labels
+from outbox import enqueue_email
+from message_writer import message_writer
+import time
 
 # Load environment variables from .env file
 load_dotenv()
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM=f"DocGenius AI <{os.getenv('MAIL_USERNAME')}>",
-    MAIL_PORT=587,
-    MAIL_SERVER="smtp.gmail.com",  # Change for other providers
-    MAIL_STARTTLS=True,  # Replaces MAIL_TLS
-    MAIL_SSL_TLS=False,  # Replaces MAIL_SSL
-    USE_CREDENTIALS=True
-)
+# Map-reduce summarization: chunk size (BART reads at most 1024 tokens), per-chunk summary length,
+# chunks per forward pass and maximum number of reduce levels
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "900"))
+SUMMARY_CHUNK_SUMMARY_TOKENS = int(os.getenv("SUMMARY_CHUNK_SUMMARY_TOKENS", "150"))
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "4"))
+SUMMARY_MAX_DEPTH = int(os.getenv("SUMMARY_MAX_DEPTH", "3"))
+
+# Default and maximum number of messages returned per history page
+MESSAGES_PAGE_SIZE = int(os.getenv("MESSAGES_PAGE_SIZE", "20"))
+MESSAGES_MAX_PAGE_SIZE = 100
+
+# Previous questions of the chat prepended to a new one as conversation context (0 disables it)
+CHAT_CONTEXT_MESSAGES = int(os.getenv("CHAT_CONTEXT_MESSAGES", "3"))
+
+# Sentences encoded per MiniLM call during ingestion
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+# Bulk uploads pool the chunks of all their documents into larger encode batches
+EMBEDDING_BULK_BATCH_SIZE = int(os.getenv("EMBEDDING_BULK_BATCH_SIZE", "256"))
+
+# Answer modes: "extractive" returns the ranked passages (milliseconds), "abstractive" has BART
+# rewrite them (seconds), "auto" answers extractively while ANSWER_AUTO_MAX_GENERATIONS BART
+# generations are already running
+ANSWER_MODES = ("extractive", "abstractive", "auto")
+ANSWER_MODE_DEFAULT = os.getenv("ANSWER_MODE_DEFAULT", "abstractive")
+ANSWER_AUTO_MAX_GENERATIONS = int(os.getenv("ANSWER_AUTO_MAX_GENERATIONS", "2"))
+
+_active_generations = 0  # BART generations in flight; only touched on the event loop
+
 # User creation (Sign up)
 async def create_user(user: User):
     db = get_db()
     # Hash the password before saving to the database
-    existing_user = db.users.find_one({"email": user.email})
+    existing_user = await db.users.find_one({"email": user.email})
     print(existing_user)
     if existing_user:
         raise HTTPException(
@@ -41,12 +65,12 @@ async def create_user(user: User):
             detail="Account with this Email already exists"
         )
     user_data = dict(user)
-    user_data["password"] = hash_password(user.password)
+    user_data["password"] = await hash_password_async(user.password)
     user_data["verify"] = False
-    result = db.users.insert_one(user_data)
+    result = await db.users.insert_one(user_data)
 
-    token = generate_token(user_data)
-    print(token)
+    # Only good for the verification link, not as a login token
+    token = create_access_token(data={"user_id": str(user_data["_id"])}, token_type=VERIFY_TOKEN)
     html_body = f"""
 <!DOCTYPE html>
 <html lang='en'>
@@ -131,7 +155,7 @@ async def create_user(user: User):
             <p>Welcome to <strong>DocGenius</strong> – your AI-powered assistant for document-based question answering.</p>
             <p>To activate your account and start using DocGenius, please verify your email by clicking the button below:</p>
             <div class='button-container'>
-                <a href="{os.getenv('VARIFY_URL')}/verify/{str(token['access_token'])}" class='verify-button'>Verify Account</a>
+                <a href="{os.getenv('VARIFY_URL')}/verify/{token}" class='verify-button'>Verify Account</a>
             </div>
             <p>If you did not request this registration, you can safely ignore this email.</p>
             <p>Thank you,<br>The DocGenius Team</p>
@@ -145,24 +169,18 @@ async def create_user(user: User):
 </html>
 """
 
-    message = MessageSchema(
-        subject="Verify Your Email for DocGenius AI",
-        recipients=[user_data["email"]],
-        body=html_body,
-        subtype="html"
-    )
-    fm = FastMail(conf)
-    await fm.send_message(message)
+    # Sent by the outbox worker, so signup doesn't wait for the mail server
+    await enqueue_email(user_data["email"], "Verify Your Email for DocGenius AI", html_body)
     # return str(result.inserted_id)  # Return the user ID as string
     return 
 
 # Authenticate User (Login)
-def authenticate_user(email: str, password: str):
+async def authenticate_user(email: str, password: str):
     db = get_db()
-    user = db.users.find_one({"email": email})
+    user = await db.users.find_one({"email": email})
     
     # If user doesn't exist or password is incorrect
-    if not user or not verify_password(password, user['password']):
+    if not user or not await verify_password_async(password, user['password']):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect credentials"
@@ -180,47 +198,27 @@ def authenticate_user(email: str, password: str):
     chats = []
     
     if chat_ids:
-        # Query the chats collection using chat_ids
-        chats = list(db.chats.find({"_id": {"$in": [ObjectId(chat_id) for chat_id in chat_ids]}}))
-        
-          # For each chat, populate the messages and associated document metadata
-        for chat in chats:
-        # For each chat, populate the messages and associated document metadata
-         # Fetch the message_ids related to the current chat
-            message_ids = chat.get("message_ids", [])
-            
-            # Fetch the associated messages using the message_ids
-            messages = list(db.messages.find({"_id": {"$in": [ObjectId(msg_id) for msg_id in message_ids]}}))
-            
-            # Add the messages to the chat data and convert ObjectId to string
-            chat["messages"] = [
-                {
-                    "_id": str(message["_id"]),  # Convert ObjectId to string
-                    "text": message["text"],
-                    "answer": message["answer"],
-                    "timestamp": message["timestamp"]
-                }
-                for message in messages
-            ]
-            
-            
-            # Populate document metadata if applicable
-            # if chat.get("document_path"):
-            #     # Fetch document metadata (for example, document summary, sentences, embeddings)
-            #     document_data = {
-            #         "document_path": chat["document_path"],
-            #         "timestamp": chat["timestamp"],
-            #         "type": chat["type"],
-            #         "size": chat["size"],
-            #         "doc_summary": chat["doc_summary"],
-            #         "sentences": chat.get("sentences", []),
-            #         "embeddings": chat.get("embeddings", [])
-            #     }
-            #     chat["document_data"] = document_data
+        # One aggregation for all chat metadata; the large sentences/embeddings fields are never read
+        # and messages are loaded on demand (see get_messages)
+        chats = await db.chats.aggregate([
+            {"$match": {"_id": {"$in": [ObjectId(chat_id) for chat_id in chat_ids]}}},
+            {"$project": {
+                "document_path": 1,
+                "file_name": 1,
+                "timestamp": 1,
+                "type": 1,
+                "size": 1,
+                "doc_summary": 1,
+                "status": 1,
+                "message_count": {"$size": {"$ifNull": ["$message_ids", []]}},
+            }},
+            {"$sort": {"timestamp": -1}},
+        ]).to_list(length=None)
     
     # Prepare the final user data to return
     user_data = {
         "_id": str(user["_id"]),  # Convert ObjectId to string
+        "token": generate_token(user),  # Bearer token for the chat endpoints
         "name": user["name"],
         "email": user["email"],
         "verify": user.get("verify", False),
@@ -228,13 +226,14 @@ def authenticate_user(email: str, password: str):
             {
                 "_id": str(chat["_id"]),  # Convert ObjectId to string
                 # "chat_name": chat.get("chat_name", "Unnamed Chat"),
-                "messages": chat.get("messages", []),  # Include messages if available
+                "message_count": chat["message_count"],
                 "document_path": chat["document_path"],
+                "file_name": chat.get("file_name"),
                 "timestamp": chat["timestamp"],
                 "type": chat["type"],
                 "size": chat["size"],
                 "doc_summary": chat["doc_summary"],
-                # "document_data": chat.get("document_data", {})  # Include document metadata
+                "status": chat.get("status", "done"),
             }
             for chat in chats
         ]
@@ -242,15 +241,80 @@ def authenticate_user(email: str, password: str):
 
     return user_data
 
+def message_cursor(message: dict) -> str:
+    """Paging cursor just past a message: its timestamp and id (messages saved together share a timestamp)."""
+    return f"{message['timestamp'].isoformat()}_{message['_id']}"
+
+def parse_message_cursor(cursor: str):
+    """(timestamp, id) from message_cursor; cursors of older clients hold only the timestamp."""
+    timestamp, _, message_id = cursor.partition("_")
+    try:
+        return datetime.fromisoformat(timestamp), ObjectId(message_id) if message_id else None
+    except (ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def key_messages_by_chat(chat_id: str, message_ids):
+    """Store chat_id on messages saved before messages carried it, so the chat can be paged by index."""
+    db = get_db()
+    if message_ids:
+        await db.messages.update_many(
+            {"_id": {"$in": message_ids}, "chat_id": {"$exists": False}}, {"$set": {"chat_id": ObjectId(chat_id)}}
+        )
+    await db.chats.update_one({"_id": ObjectId(chat_id)}, {"$set": {"messages_keyed": True}})
+
+async def get_messages(chat_id: str, before: str = None, limit: int = MESSAGES_PAGE_SIZE):
+    """Page through a chat's messages, newest first; `before` is the next_before cursor of the previous page."""
+    db = get_db()
+    chat = await db.chats.find_one({"_id": ObjectId(chat_id)}, {"message_ids": 1, "recent_messages": 1, "messages_keyed": 1})
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    recent = chat.get("recent_messages", [])
+    if before is None and (len(recent) > limit or len(recent) == len(chat.get("message_ids", []))):
+        # The latest page is embedded in the chat (it holds every message of short chats)
+        messages = recent[::-1][:limit + 1]
+    else:
+        if not chat.get("messages_keyed"):
+            await key_messages_by_chat(chat_id, chat.get("message_ids", []))
+
+        # Served by the (chat_id, timestamp, _id) index, newest first
+        query = {"chat_id": ObjectId(chat_id)}
+        if before is not None:
+            timestamp, message_id = parse_message_cursor(before)
+            if message_id is None:
+                query["timestamp"] = {"$lt": timestamp}
+            else:
+                query["$or"] = [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "_id": {"$lt": message_id}}]
+
+        # Fetch one extra message to know whether there is another page
+        messages = await (
+            db.messages.find(query, {"text": 1, "answer": 1, "timestamp": 1})
+            .sort([("timestamp", -1), ("_id", -1)])
+            .limit(limit + 1)
+            .to_list(length=limit + 1)
+        )
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    return {
+        # Oldest first, the order the chat displays them in
+        "messages": [
+            {
+                "_id": str(message["_id"]),  # Convert ObjectId to string
+                "text": message["text"],
+                "answer": message["answer"],
+                "timestamp": message["timestamp"]
+            }
+            for message in reversed(messages)
+        ],
+        "next_before": message_cursor(messages[-1]) if has_more else None,
+    }
+
 # Generate JWT Token
 def generate_token(user_data):
     access_token = create_access_token(data={"user_id": str(user_data["_id"])})
     return {"access_token": access_token, "token_type": "bearer"}
 
-# Utility function to split text into sentences
-def split_into_sentences(text: str) -> List[str]:
-    return [sent.strip() for sent in text.split('.') if sent.strip()]
-
 # services.py
 
 # The function to clean the extracted text (if needed)
@@ -258,149 +322,707 @@ def clean_text(raw_text: str) -> str:
     # A placeholder for any text cleaning logic you might want
     return raw_text.strip()
 
-def summarize_text(text: str) -> str:
+def summarize_text(text: str, depth: int = 0) -> str:
     # Use Hugging Face's BART summarizer to generate a summary
-    summary = summarizer(text, max_length=500, min_length=50, do_sample=False)
-    return summary[0]['summary_text']
+    summarizer = get_summarizer()
+    tokenizer = summarizer.tokenizer
 
-async def create_chat(file_size: int,file_extension: str, user_id: str,raw_text: str, document_path: str = None):
-    
-    # Clean and summarize the extracted text
-    cleaned_text = clean_text(raw_text)
-    # Summarize the cleaned text using Hugging Face summarizer
-    doc_summary = summarize_text(cleaned_text)
-    # Split cleaned text into sentences
-    sentences = split_into_sentences(cleaned_text)
-    # Generate embeddings for each sentence
-    sentence_embeddings = embedding_model.encode(sentences)
+    # Short enough for a single BART pass (or out of reduce levels): summarize directly
+    if depth >= SUMMARY_MAX_DEPTH or len(tokenizer(text)["input_ids"]) <= SUMMARY_CHUNK_TOKENS:
+        summary = summarizer(text, max_length=500, min_length=50, do_sample=False, truncation=True)
+        return summary[0]['summary_text']
+
+    # Map: summarize every chunk, batching the forward passes so the whole document is covered
+    chunks = chunk_text(text, tokenizer, max_tokens=SUMMARY_CHUNK_TOKENS, overlap=0)
+    chunk_summaries = summarizer(
+        [chunk["text"] for chunk in chunks],
+        batch_size=SUMMARY_BATCH_SIZE,
+        max_length=SUMMARY_CHUNK_SUMMARY_TOKENS,
+        min_length=min(30, SUMMARY_CHUNK_SUMMARY_TOKENS),
+        do_sample=False,
+        truncation=True,
+    )
+
+    # Reduce: summarize the concatenated chunk summaries, recursing until they fit in one pass
+    combined = " ".join(output['summary_text'] for output in chunk_summaries)
+    return summarize_text(combined, depth + 1)
+
+# Processed artifacts are stored once per distinct upload in `documents`, keyed by the SHA-256 of the
+# bytes, and shared by every chat made from the same file; `refcount` counts those chats
+SHARED_DOCUMENT_SUMMARY = {"sentences": 0, "chunks": 0, "embeddings": 0}
 
-    # Convert sentence embeddings to a list (for MongoDB compatibility)
-    sentence_embeddings_list = sentence_embeddings.tolist()
+# An ingesting document holds a lease that its job keeps renewing; once it runs out (the process
+# restarted, or the upload failed before the job started) it is reported failed and the next upload
+# of the bytes takes it over
+DOCUMENT_LEASE_SECONDS = int(os.getenv("DOCUMENT_LEASE_SECONDS", "600"))
+DOCUMENT_TERMINAL_STATUSES = ("done", "failed")
+STALE_DOCUMENT_ERROR = "Processing was interrupted, upload the document again"
 
+def lease_until() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=DOCUMENT_LEASE_SECONDS)
 
+def stale_document_filter(now: datetime) -> dict:
+    """Documents still being ingested whose worker is gone (lease expired, or none from older versions)."""
+    return {
+        "status": {"$nin": list(DOCUMENT_TERMINAL_STATUSES)},
+        "$or": [{"lease_until": {"$lt": now}}, {"lease_until": {"$exists": False}}],
+    }
+
+def abandoned_document_filter(now: datetime) -> dict:
+    """Documents whose ingestion failed or was abandoned."""
+    return {"$or": [{"status": "failed"}, stale_document_filter(now)]}
+
+async def fail_stale_documents(content_hashes: List[str] = None) -> int:
+    """Mark stale documents (all of them, or only these) failed, so their chats stop waiting for them.
+
+    Checked by the status endpoint and once at startup. Uploading the file again retries it.
+    """
+    db = get_db()
+    query = stale_document_filter(datetime.utcnow())
+    if content_hashes is not None:
+        query = {"_id": {"$in": content_hashes}, **query}
+    failed = 0
+    for document in await db.documents.find(query, {"_id": 1}).to_list(length=None):
+        # Guarded again, so a takeover by a new upload in the meantime is left alone
+        result = await db.documents.update_one(
+            {"_id": document["_id"], **stale_document_filter(datetime.utcnow())},
+            {"$set": {"status": "failed", "error": STALE_DOCUMENT_ERROR}, "$unset": {"lease_until": ""}},
+        )
+        if result.modified_count:
+            failed += 1
+            await db.chats.update_many(
+                {"document_hash": document["_id"]}, {"$set": {"status": "failed", "error": STALE_DOCUMENT_ERROR}}
+            )
+    return failed
+
+async def claim_document(content_hash: str, document_path: str, file_extension: str):
+    """Take a reference on the shared document for these bytes.
+
+    Returns (document, owner). The owner is the first upload of the file (or a retry after a failed
+    or abandoned ingestion) and has to run the ingestion; everyone else just references the stored result.
+    """
+    db = get_db()
+    document = await db.documents.find_one_and_update(
+        {"_id": content_hash},
+        {
+            "$inc": {"refcount": 1},
+            "$setOnInsert": {
+                "document_path": document_path,
+                "type": file_extension,
+                "timestamp": datetime.utcnow(),
+                "status": "queued",
+                "lease_until": lease_until(),
+            },
+        },
+        projection=SHARED_DOCUMENT_SUMMARY,
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+    )
+    if document is None:
+        return {"_id": content_hash, "document_path": document_path, "status": "queued"}, True
+
+    if document.get("status") != "done":
+        # The last attempt at these bytes failed or died: retry with this upload (only one concurrent upload wins)
+        result = await db.documents.update_one(
+            {"_id": content_hash, **abandoned_document_filter(datetime.utcnow())},
+            {"$set": {"status": "queued", "document_path": document_path, "lease_until": lease_until()}, "$unset": {"error": ""}},
+        )
+        if result.modified_count:
+            return {**document, "document_path": document_path, "status": "queued", "doc_summary": None}, True
+
+    return document, False
+
+async def release_document(content_hash: str):
+    """Drop a chat's reference on a shared document, deleting the document with its last chat."""
+    db = get_db()
+    document = await db.documents.find_one_and_update(
+        {"_id": content_hash},
+        {"$inc": {"refcount": -1}},
+        projection={"refcount": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if document and document["refcount"] <= 0:
+        # Guarded on the count so a chat created in the meantime keeps the document alive
+        result = await db.documents.delete_one({"_id": content_hash, "refcount": {"$lte": 0}})
+        if result.deleted_count:
+            index_cache.invalidate(content_hash)
+            await run_in_threadpool(remove_indexes, content_hash)
+
+async def create_chat(file_size: int,file_extension: str, user_id: str, document_path: str = None,
+                      content_hash: str = None, status: str = "queued", doc_summary: str = None,
+                      file_name: str = None):
+    chats = await create_chats(user_id, [{
+        "file_size": file_size,
+        "file_extension": file_extension,
+        "file_name": file_name,
+        "document_path": document_path,
+        "content_hash": content_hash,
+        "status": status,
+        "doc_summary": doc_summary,
+    }])
+    return chats[0]
+
+async def create_chats(user_id: str, chats: List[dict]):
+    """Create several chats for one user with a single insert and a single update of the user.
+
+    Each entry holds the create_chat arguments (file_size, file_extension, file_name, document_path,
+    content_hash, status, doc_summary). Returns the created chats in the same order.
+    """
     db = get_db()
     
-    chat_data = {
+    # The chat is created right away; its status follows the shared document (see set_document_status)
+    now = datetime.utcnow()
+    chat_docs = [{
     "user_id": ObjectId(user_id),  # Storing the user reference (ObjectId)
     "message_ids": [],  # Start with an empty list of message references
-    "document_path": document_path,  # Save the document path in the chat
-    "timestamp": datetime.utcnow(),  # Set the current timestamp
-    "type": file_extension,  # Set the file extension as the type
-    "size": int(file_size/1024),  # Store the file size in KB (integer)
-    "doc_summary": doc_summary,  # Store the document summary
-    "sentences" : sentences,
-    "embeddings": sentence_embeddings_list
-
-}
-
-    # Insert the chat into the database
-    result = db.chats.insert_one(chat_data)
+    "recent_messages": [],  # Latest messages, capped (see message_writer)
+    "messages_keyed": True,  # Its messages carry chat_id (see get_messages)
+    "document_path": chat.get("document_path"),  # Save the document path in the chat
+    "file_name": chat.get("file_name"),  # The uploader's name for the file (the shared blob is named by hash)
+    "timestamp": now,  # Set the current timestamp
+    "type": chat["file_extension"],  # Set the file extension as the type
+    "size": int(chat["file_size"]/1024),  # Store the file size in KB (integer)
+    "doc_summary": chat.get("doc_summary"),  # Filled in once the document is summarized
+    "status": chat.get("status", "queued"),  # queued -> extracting -> embedding -> summarizing -> done / failed
+    "document_hash": chat.get("content_hash"),  # The shared document holding the sentences and embeddings
+    "last_active": now,  # Updated with every message (index warm-up order)
+} for chat in chats]
+
+    # Insert the chats into the database
+    result = await db.chats.insert_many(chat_docs)
     
-    # Update the user's chat_ids to include the new chat
-    db.users.update_one(
+    # Update the user's chat_ids to include the new chats
+    await db.users.update_one(
         {"_id": ObjectId(user_id)},
-        {"$push": {"chat_ids": result.inserted_id}}
+        {"$push": {"chat_ids": {"$each": result.inserted_ids}}}
     )
+    principal_cache.invalidate(user_id)
+
+    # Duplicates of finished documents are searchable right away
+    done = [(chat_id, chat) for chat_id, chat in zip(result.inserted_ids, chat_docs) if chat["status"] == "done" and chat["document_hash"]]
+    if done and user_indexes.peek(str(user_id)) is not None:
+        hashes = list({chat["document_hash"] for _, chat in done})
+        documents = {
+            document["_id"]: document
+            for document in await db.documents.find(
+                {"_id": {"$in": hashes}}, {"sentences": 1, "chunks": 1, "embeddings": 1, "embedding_dtype": 1, "embedding_dim": 1}
+            ).to_list(length=None)
+        }
+        for chat_id, chat in done:
+            if chat["document_hash"] in documents:
+                await add_to_user_index(user_id, chat_id, documents[chat["document_hash"]], chat["document_path"], chat["file_name"])
     
-    # Return the created chat with its `_id` and document_path
+    # Return the created chats with their `_id` and document_path
+    return [{
+        "_id": str(chat_id),  # Ensure _id is serialized as string
+        "document_path": chat["document_path"],
+        "file_name": chat["file_name"],
+        "timestamp": chat["timestamp"],
+        "type": chat["type"],
+        "size": chat["size"],
+        "doc_summary": chat["doc_summary"],
+        "status": chat["status"],
+    } for chat_id, chat in zip(result.inserted_ids, chat_docs)]
+
+async def set_document_status(content_hash: str, status: str, **fields):
+    """Store ingestion progress or results on the shared document and mirror the status on its chats."""
+    db = get_db()
+    if status in DOCUMENT_TERMINAL_STATUSES:
+        update = {"$set": {"status": status, **fields}, "$unset": {"lease_until": ""}}
+    else:
+        update = {"$set": {"status": status, "lease_until": lease_until(), **fields}}
+    await db.documents.update_one({"_id": content_hash}, update)
+
+    chat_fields = {key: value for key, value in fields.items() if key in ("doc_summary", "error")}
+    await db.chats.update_many({"document_hash": content_hash}, {"$set": {"status": status, **chat_fields}})
+
+    if status == "done":
+        # The chats just became searchable: add them to their owners' loaded cross-document indexes
+        chats = await db.chats.find({"document_hash": content_hash}, {"user_id": 1, "document_path": 1, "file_name": 1}).to_list(length=None)
+        for chat in chats:
+            await add_to_user_index(chat["user_id"], chat["_id"], fields, chat["document_path"], chat.get("file_name"))
+
+async def renew_document_leases(content_hashes: List[str]):
+    """Extend the lease of documents that are still being ingested (called periodically by their job)."""
+    await get_db().documents.update_many(
+        {"_id": {"$in": content_hashes}, "status": {"$nin": list(DOCUMENT_TERMINAL_STATUSES)}},
+        {"$set": {"lease_until": lease_until()}},
+    )
+
+async def add_to_user_index(user_id, chat_id, document: dict, document_path: str, file_name: str = None):
+    """Add a finished chat to its user's cross-document index, if that index is loaded."""
+    index = user_indexes.peek(str(user_id))
+    if index is None:
+        # Not loaded: load_user_index reads the chat from the database when it is needed
+        return
+    await run_in_threadpool(
+        index.add_chat,
+        str(chat_id),
+        unpack_embeddings(document),
+        document.get("sentences", []),
+        document.get("chunks"),
+        document_path,
+        file_name,
+    )
+
+async def load_user_index(user_id: str) -> UserIndex:
+    """The user's cross-document index, built from all their finished chats on first use."""
+    index = user_indexes.get(user_id)
+    if index is not None:
+        return index
+
+    db = get_db()
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, {"chat_ids": 1})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    content_fields = {"sentences": 1, "chunks": 1, "embeddings": 1, "embedding_dtype": 1, "embedding_dim": 1}
+    chats = await db.chats.find(
+        {"_id": {"$in": user.get("chat_ids", [])}, "status": {"$in": ["done", None]}},
+        {"document_path": 1, "file_name": 1, "document_hash": 1, **content_fields},
+    ).to_list(length=None)
+
+    # Deduplicated chats keep their content on the shared document: fetch those in one query
+    hashes = list({chat["document_hash"] for chat in chats if chat.get("document_hash")})
+    documents = {}
+    if hashes:
+        documents = {
+            document["_id"]: document
+            for document in await db.documents.find({"_id": {"$in": hashes}}, content_fields).to_list(length=None)
+        }
+
+    def build():
+        index = UserIndex()
+        for chat in chats:
+            source = documents.get(chat["document_hash"]) if chat.get("document_hash") else chat
+            if source and source.get("sentences"):
+                index.add_chat(str(chat["_id"]), unpack_embeddings(source), source["sentences"], source.get("chunks"), chat["document_path"], chat.get("file_name"))
+        return index
+
+    return user_indexes.put(user_id, await run_in_threadpool(build))
+
+async def search_documents(user_id: str, text: str, k: int = 5, chat_ids=None):
+    """Top passages for a query across every document the user has uploaded.
+
+    `chat_ids` are the user's current chats (from the authenticated principal). A loaded index only
+    sees changes made in this process, so one that still holds a chat deleted elsewhere is rebuilt,
+    and results are limited to these chats. The cached principal can itself miss a chat created by
+    another worker, so a mismatch reloads it first and only rebuilds if the chat is really gone.
+    """
+    index = await load_user_index(user_id)
+    if chat_ids is not None and index.chat_ids() - chat_ids:
+        chat_ids = (await load_principal(user_id))["chat_ids"]
+        if index.chat_ids() - chat_ids:
+            user_indexes.invalidate(user_id)
+            index = await load_user_index(user_id)
+    query_vector = await run_in_threadpool(embed_text, text)
+    with span("cross_document_search"):
+        results = await run_in_threadpool(index.search, query_vector, k)
+    if chat_ids is not None:
+        results = [result for result in results if result["chat_id"] in chat_ids]
+    return {"query": text, "results": results}
+
+def process_document(pages, on_stage=None, labels=None):
+    """Chunk, embed and summarize an extracted document and return the fields to store on it.
+
+    Runs on an ingestion worker thread. `pages` is an iterable of (page_number, text); chunks are
+    encoded in batches while later pages are still being extracted. `on_stage` is called with
+    "embedding" and "summarizing" as the work progresses. `labels` tag the stage timings.
+    """
+    on_stage = on_stage or (lambda stage: None)
+    embedding_model = get_embedding_model()
+    page_texts, chunk_texts, chunk_locations = [], [], []
+    embedding_batches, pending = [], []
+    # Extraction and encoding interleave, so their time is summed and recorded once per document
+    elapsed = {"extraction": 0.0, "encoding": 0.0}
+
+    def read_pages():
+        page_iter = iter(pages)
+        while True:
+            start = time.perf_counter()
+            page = next(page_iter, None)
+            elapsed["extraction"] += time.perf_counter() - start
+            if page is None:
+                return
+            page_texts.append(page[1])
+            yield page
+
+    def encode(texts):
+        start = time.perf_counter()
+        vectors = embedding_model.encode(texts, batch_size=EMBEDDING_BATCH_SIZE)
+        elapsed["encoding"] += time.perf_counter() - start
+        return vectors
+
+    # Split each page into token-bounded chunks as soon as it arrives
+    for chunk in chunk_pages(read_pages(), embedding_model.tokenizer):
+        chunk_texts.append(chunk["text"])
+        chunk_locations.append({"page": chunk["page"], "start": chunk["start"], "end": chunk["end"]})
+        pending.append(chunk["text"])
+
+        # Generate embeddings for each full batch of chunks
+        if len(pending) >= EMBEDDING_BATCH_SIZE:
+            if not embedding_batches:
+                on_stage("embedding")
+            embedding_batches.append(encode(pending))
+            pending = []
+
+    if pending:
+        # Most documents have less than one full batch: they reach "embedding" only here
+        if not embedding_batches:
+            on_stage("embedding")
+        embedding_batches.append(encode(pending))
+    for stage, seconds in elapsed.items():
+        observe_stage(stage, seconds, labels)
+    chunk_embeddings = np.concatenate(embedding_batches) if embedding_batches else np.empty((0, 0), dtype="float32")
+
+    on_stage("summarizing")
+    return document_fields(page_texts, chunk_texts, chunk_locations, chunk_embeddings, labels)
+
+def extract_document(pages, labels=None):
+    """Extract and chunk a whole document without encoding it.
+
+    Used by bulk ingestion, which encodes the chunks of many documents together (see encode_chunks).
+    Returns (page_texts, chunk_texts, chunk_locations).
+    """
+    tokenizer = get_embedding_model().tokenizer
+    page_texts, chunk_texts, chunk_locations = [], [], []
+
+    elapsed = 0.0
+
+    def read_pages():
+        nonlocal elapsed
+        page_iter = iter(pages)
+        while True:
+            start = time.perf_counter()
+            page = next(page_iter, None)
+            elapsed += time.perf_counter() - start
+            if page is None:
+                return
+            page_texts.append(page[1])
+            yield page
+
+    for chunk in chunk_pages(read_pages(), tokenizer):
+        chunk_texts.append(chunk["text"])
+        chunk_locations.append({"page": chunk["page"], "start": chunk["start"], "end": chunk["end"]})
+    observe_stage("extraction", elapsed, labels)
+    return page_texts, chunk_texts, chunk_locations
+
+def encode_chunks(chunk_texts_per_document: List[List[str]], labels=None):
+    """Encode the chunks of several documents in shared EMBEDDING_BULK_BATCH_SIZE batches.
+
+    Returns one embedding array per document, in order.
+    """
+    texts = [text for chunk_texts in chunk_texts_per_document for text in chunk_texts]
+    if not texts:
+        return [np.empty((0, 0), dtype="float32") for _ in chunk_texts_per_document]
+    with span("encoding", labels):
+        vectors = get_embedding_model().encode(texts, batch_size=EMBEDDING_BULK_BATCH_SIZE)
+    vectors = np.asarray(vectors)
+
+    bounds = np.cumsum([0] + [len(chunk_texts) for chunk_texts in chunk_texts_per_document])
+    return [
+        vectors[start:end] if end > start else np.empty((0, 0), dtype="float32")
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+def document_fields(page_texts, chunk_texts, chunk_locations, chunk_embeddings, labels=None):
+    """Summarize an extracted, encoded document and return the fields to store on it."""
+    # Pack chunk embeddings into one binary blob (much smaller and faster to decode than BSON arrays)
+    packed_embeddings = pack_embeddings(chunk_embeddings)
+
+    # Summarize the cleaned text using Hugging Face summarizer
+    cleaned_text = clean_text("\n".join(page_texts))
+    with span("summarization", labels):
+        doc_summary = summarize_text(cleaned_text)
+
     return {
-        "_id": str(result.inserted_id),  # Ensure _id is serialized as string
-        "document_path": document_path,
-        "timestamp": chat_data["timestamp"],
-        "type": chat_data["type"],
-        "size": chat_data["size"],
-        "doc_summary": chat_data["doc_summary"],
+        "doc_summary": doc_summary,
+        "sentences": chunk_texts,  # retrieval units, kept under the original field name
+        "chunks": chunk_locations,  # page and character offsets of each retrieval unit
+        "page_count": len(page_texts),
+        **packed_embeddings,
+    }
+
+async def get_chat_status(chat_id: str):
+    db = get_db()
+    chat = await db.chats.find_one({"_id": ObjectId(chat_id)}, {"status": 1, "error": 1, "doc_summary": 1, "document_hash": 1})
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    if chat.get("status", "done") not in DOCUMENT_TERMINAL_STATUSES and chat.get("document_hash"):
+        # The worker ingesting the document died: report it failed instead of polling forever
+        if await fail_stale_documents([chat["document_hash"]]):
+            chat.update(status="failed", error=STALE_DOCUMENT_ERROR)
+
+    return {
+        "_id": str(chat["_id"]),
+        # Chats created before background ingestion have no status and are always complete
+        "status": chat.get("status", "done"),
+        "error": chat.get("error"),
+        "doc_summary": chat.get("doc_summary"),
     }
 
 
-def send_message(chat_id: str, text: str):
+# What load_document_index needs from a document (or legacy chat)
+RETRIEVAL_FIELDS = {"index_version": 1, "sentences": 1, "chunks": 1}
+
+async def load_document_index(key: str, document: dict, collection, labels: dict = None):
+    """The FAISS index of a document (or legacy chat), keyed by its hash (or chat id).
+
+    Opened from INDEX_DIRECTORY when a file for the document's current index_version exists;
+    otherwise built from the embeddings in Mongo and written there for the next process.
+    `document` needs its sentences and chunks, which are kept with the index for the index cache.
+    """
+    sentences, chunks = document.get("sentences", []), document.get("chunks", [])
+    if not sentences:
+        raise ValueError("No sentences or embeddings found in chat")
+
+    start = time.perf_counter()
+    index, mapped = await run_in_threadpool(load_index, key, document.get("index_version"))
+    if index is not None:
+        observe_stage("index_load", time.perf_counter() - start, labels)
+        return DocumentIndex(index, sentences, chunks, index_nbytes(index, mapped))
+
+    packed = await collection.find_one({"_id": document["_id"]}, {"embeddings": 1, "embedding_dtype": 1, "embedding_dim": 1})
+    embeddings = unpack_embeddings(packed or {})
+    if len(embeddings) == 0:
+        raise ValueError("No sentences or embeddings found in chat")
+
+    version = index_version(packed)
+    with span("index_build", labels):
+        index = await run_in_threadpool(build_and_save, embeddings, key, version)
+    if version and version != document.get("index_version"):
+        await collection.update_one({"_id": document["_id"]}, {"$set": {"index_version": version}})
+    return DocumentIndex(index, sentences, chunks, index_nbytes(index))
+
+async def warm_up_indexes(limit: int):
+    """Load the indexes of the most recently active chats into the index cache."""
+    db = get_db()
+    chats = await (
+        db.chats.find({"status": {"$in": ["done", None]}}, {"document_hash": 1, "index_version": 1})
+        .sort("last_active", -1)
+        .limit(limit)
+        .to_list(length=limit)
+    )
+    loaded = 0
+    for chat in chats:
+        key = chat.get("document_hash") or str(chat["_id"])
+        if key in index_cache:
+            continue
+        collection = db.documents if chat.get("document_hash") else db.chats
+        document = await collection.find_one({"_id": chat.get("document_hash") or chat["_id"]}, RETRIEVAL_FIELDS)
+        if not document:
+            continue
+        try:
+            index_cache.put(key, await load_document_index(key, document, collection))
+            loaded += 1
+        except ValueError:
+            continue
+    print(f"Warmed up {loaded} chat indexes")
+
+async def retrieve_context(chat_id: str, text: str, use_cache: bool = True):
+    """Embed the question and find the chat's most relevant sentences (or a cached answer)."""
     db = get_db()
 
-    # Fetch chat data and embeddings
-    chat = db.chats.find_one({"_id": ObjectId(chat_id)})
+    # Fetch chat data; the sentences, chunks and embeddings of older chats are only read on an index
+    # cache miss and the full message history is never needed here (the capped recent messages provide the context)
+    chat = await db.chats.find_one({"_id": ObjectId(chat_id)}, {"embeddings": 0, "sentences": 0, "chunks": 0, "message_ids": 0})
     if not chat:
         raise ValueError("Chat not found")
+    if chat.get("status", "done") != "done":
+        raise HTTPException(status_code=409, detail="Document is still being processed")
+
+    # Deduplicated chats share the document's index; older chats keep their data on the chat itself
+    content_hash = chat.get("document_hash")
+    index_key = content_hash or chat_id
 
-    sentences = chat.get("sentences", [])
-    embeddings = chat.get("embeddings", [])
-    messages = chat.get("messages", [])
+    labels = document_labels(chat.get("type"), chat.get("size"))
+    messages = chat.get("recent_messages", [])[-CHAT_CONTEXT_MESSAGES:] if CHAT_CONTEXT_MESSAGES > 0 else []
 
     # Retrieve previous messages for better context
-    past_context = " ".join([msg["text"] for msg in messages[-3:]])  # Get last 3 messages
-    full_query = past_context + " " + text  # Merge context with the current query
+    past_context = " ".join([msg["text"] for msg in messages])  # Get the last CHAT_CONTEXT_MESSAGES questions
+    full_query = (past_context + " " + text).strip()  # Merge context with the current query
 
-     # Embed the combined query
-    query_vector = embed_text(full_query)
+    # Embed the combined query for retrieval and the question alone for the answer cache, which must
+    # not match on the shared conversation context (blocks on the query batcher, so off the event loop)
+    with span("query_embedding", labels):
+        if full_query != text:
+            question_vector, query_vector = await run_in_threadpool(embed_texts, [text, full_query])
+        else:
+            question_vector = query_vector = await run_in_threadpool(embed_text, text)
 
+    # Repeated or near-duplicate question: reuse the stored answer, skipping retrieval and generation
+    cached = answer_cache.get(chat_id, question_vector) if use_cache else None
+    if cached is not None:
+        return {"question_vector": question_vector, "top_sentences": [], "scores": [], "sources": cached["sources"], "cached_answer": cached["answer"], "labels": labels}
 
-    if not sentences or not embeddings:
-        raise ValueError("No sentences or embeddings found in chat")
-    
-    # Convert embeddings to FAISS index
-    index = build_faiss_index(embeddings)
+    index = index_cache.get(index_key)
+    if index is None:
+        # Open (or build) the FAISS index and keep it, with the texts it retrieves, for follow-up questions
+        collection = db.documents if content_hash else db.chats
+        document = await collection.find_one({"_id": content_hash or ObjectId(chat_id)}, RETRIEVAL_FIELDS)
+        if not document:
+            raise ValueError("Document not found")
+        index = await load_document_index(index_key, document, collection, labels)
+        index_cache.put(index_key, index)
 
     # Search for relevant sentences
-    top_indices, _ = search_faiss(index, query_vector, k=3)
+    with span("search", labels):
+        top_indices, top_scores = await run_in_threadpool(search_faiss, index.index, query_vector, 3)
     
-    top_sentences = [sentences[idx] for idx in top_indices]
+    # FAISS pads with -1 when the chat has fewer than k chunks
+    hits = [(idx, score) for idx, score in zip(top_indices, top_scores) if idx >= 0]
+    top_indices = [idx for idx, _ in hits]
+    top_sentences = [index.sentences[idx] for idx in top_indices]
 
-    # Generate answer based on relevant sentences
-    answer = structure_response(top_sentences)
+    # Where each retrieved chunk came from (chats ingested before chunking have no locations)
+    sources = [index.chunks[idx] for idx in top_indices] if index.chunks else []
+    return {
+        "question_vector": question_vector,
+        "top_sentences": top_sentences,
+        "scores": [float(score) for _, score in hits],
+        "sources": sources,
+        "cached_answer": None,
+        "labels": labels,
+    }
 
+async def save_message(chat_id: str, text: str, answer: str):
     # Create a new message document
-
     message = {
         "text": text,
         "answer": answer,
         "timestamp": datetime.utcnow()
     }
     
-    # Insert the message into the database
-    result = db.messages.insert_one(message)
-    
-    # Add the message reference (_id) to the chat's messages array
-    db.chats.update_one(
-        {"_id": ObjectId(chat_id)},
-        {"$push": {"message_ids": result.inserted_id}}
-    )
+    # Insert the message and add it to the chat, grouped with other messages saved at the same time
+    message = await message_writer.write(chat_id, message)
     
     # Return the created message with its _id
     return {
-        "id": str(result.inserted_id),
+        "id": str(message["_id"]),
         "text": text,
         "answer": answer,
-        "timestamp": datetime.utcnow()
+        "timestamp": message["timestamp"],
     }
 
-def delete(chat_id: ObjectId, user_id: ObjectId):
+def resolve_answer_mode(mode: str, cached: bool) -> str:
+    """The mode a request is actually answered in (auto degrades to extractive under load)."""
+    if mode not in ANSWER_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown answer mode '{mode}'")
+    if cached:
+        # A stored BART answer costs nothing to return
+        return "abstractive"
+    if mode == "auto":
+        return "extractive" if _active_generations >= ANSWER_AUTO_MAX_GENERATIONS else "abstractive"
+    return mode
+
+async def send_message(chat_id: str, text: str, mode: str = None):
+    global _active_generations
+    mode = mode or ANSWER_MODE_DEFAULT
+    # Extractive answers are cheap and never come from (or go into) the answer cache
+    context = await retrieve_context(chat_id, text, use_cache=mode != "extractive")
+    answer = context["cached_answer"]
+    cached = answer is not None
+    mode = resolve_answer_mode(mode, cached)
+    ranked = []
+
+    if mode == "extractive":
+        with span("extractive_answer", context["labels"]):
+            answer, ranked = extractive_response(context["top_sentences"], context["scores"], text)
+    elif not cached:
+        # Generate answer based on relevant sentences
+        _active_generations += 1
+        try:
+            with span("generation", context["labels"]):
+                answer = await run_in_threadpool(structure_response, context["top_sentences"])
+        finally:
+            _active_generations -= 1
+        answer_cache.put(chat_id, context["question_vector"], {"answer": answer, "sources": context["sources"]})
+
+    message = await save_message(chat_id, text, answer)
+    return {**message, "sources": context["sources"], "cached": cached, "mode": mode, "ranked": ranked}
+
+async def stream_message(chat_id: str, text: str, mode: str = None):
+    """Answer a question as a sequence of (event, data) pairs: retrieval, token..., done."""
+    global _active_generations
+    mode = mode or ANSWER_MODE_DEFAULT
+    context = await retrieve_context(chat_id, text, use_cache=mode != "extractive")
+    answer = context["cached_answer"]
+    cached = answer is not None
+    mode = resolve_answer_mode(mode, cached)
+    ranked = []
+
+    yield "retrieval", {"sentences": context["top_sentences"], "sources": context["sources"], "cached": cached, "mode": mode}
+
+    if mode == "extractive":
+        with span("extractive_answer", context["labels"]):
+            answer, ranked = extractive_response(context["top_sentences"], context["scores"], text)
+        yield "token", {"text": answer}
+    elif cached:
+        yield "token", {"text": answer}
+    else:
+        pieces = []
+        start = time.perf_counter()
+        _active_generations += 1
+        try:
+            async for piece in iterate_in_threadpool(stream_response(context["top_sentences"])):
+                pieces.append(piece)
+                yield "token", {"text": piece}
+        finally:
+            _active_generations -= 1
+        observe_stage("generation", time.perf_counter() - start, context["labels"])
+        answer = "".join(pieces).strip()
+        answer_cache.put(chat_id, context["question_vector"], {"answer": answer, "sources": context["sources"]})
+
+    message = await save_message(chat_id, text, answer)
+    yield "done", {**message, "timestamp": message["timestamp"].isoformat(), "cached": cached, "mode": mode, "ranked": ranked}
+
+def active_generations() -> int:
+    return _active_generations
+
+async def delete(chat_id: ObjectId, user_id: ObjectId):
     db = get_db()
 
     # Fetch the chat document to get the message_ids
-    chat = db.chats.find_one({"_id": chat_id})
+    chat = await db.chats.find_one({"_id": chat_id}, {"message_ids": 1, "document_hash": 1})
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
 
     message_ids = chat.get("message_ids", [])
 
     # Step 1: Remove the chat from the user's chat_ids list
-    db.users.update_one(
+    await db.users.update_one(
         {"_id": user_id},
         {"$pull": {"chat_ids": chat_id}}
     )
+    principal_cache.invalidate(user_id)
 
-    # Step 2: Delete the chat document
-    db.chats.delete_one({"_id": chat_id})
+    # Step 2: Delete the chat document and drop its cached index
+    await db.chats.delete_one({"_id": chat_id})
+    index_cache.invalidate(str(chat_id))
+    if not chat.get("document_hash"):
+        await run_in_threadpool(remove_indexes, str(chat_id))
+    answer_cache.invalidate(str(chat_id))
 
     # Step 3: Delete all the messages related to this chat using the message_ids
     if message_ids:
-        db.messages.delete_many({"_id": {"$in": [ObjectId(mid) for mid in message_ids]}})
+        await db.messages.delete_many({"_id": {"$in": [ObjectId(mid) for mid in message_ids]}})
+
+    # Step 4: Drop the chat from the user's cross-document index
+    user_index = user_indexes.peek(str(user_id))
+    if user_index is not None:
+        await run_in_threadpool(user_index.remove_chat, str(chat_id))
+
+    # Step 5: Release the shared document (removed along with its last chat)
+    if chat.get("document_hash"):
+        await release_document(chat["document_hash"])
 
     return {"message": "Chat and associated messages deleted successfully"}
 
-def verify_user(token: str):
-     payload = verify_token(token)
+async def verify_user(token: str):
+     payload = verify_token(token, VERIFY_TOKEN)
      db = get_db()  # Get database connection
-     user = db.users.find_one({"_id": ObjectId(payload["user_id"])})
+     user = await db.users.find_one({"_id": ObjectId(payload["user_id"])})
      print(user)
      if not user:
         raise HTTPException(
@@ -412,5 +1034,5 @@ def verify_user(token: str):
             status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
             detail="Already Verified User !"
         )
-     db.users.update_one({"_id": ObjectId(payload['user_id'])}, {"$set": {"verify": True}})
+     await db.users.update_one({"_id": ObjectId(payload['user_id'])}, {"$set": {"verify": True}})
      return User(**user)
\ No newline at end of file
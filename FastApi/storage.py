@@ -0,0 +1,111 @@
+# storage.py
+import hashlib
+import os
+import shutil
+import tempfile
+
+# Which backend stores uploaded documents: "azure" (Blob Storage) or "local" (UPLOAD_DIRECTORY)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "azure")
+
+# Azure Storage connection string (from the Azure portal)
+AZURE_CONNECTION_STRING = os.getenv("AZURE_CONNECTION_STRING")
+CONTAINER_NAME = os.getenv("AZURE_CONTAINER_NAME", "documents")  # Name of the Blob Container you created
+# Blocks of this size are uploaded by this many parallel connections
+AZURE_BLOCK_SIZE_MB = int(os.getenv("AZURE_BLOCK_SIZE_MB", "4"))
+AZURE_UPLOAD_CONCURRENCY = int(os.getenv("AZURE_UPLOAD_CONCURRENCY", "4"))
+
+UPLOAD_DIRECTORY = os.getenv("UPLOAD_DIRECTORY", "public")
+LOCAL_STORAGE_BASE_URL = os.getenv("LOCAL_STORAGE_BASE_URL", "http://localhost:8000")
+
+# Uploads are spooled here so the request body isn't held in memory while the job runs
+SPOOL_DIRECTORY = os.getenv("SPOOL_DIRECTORY", tempfile.gettempdir())
+
+
+class StorageBackend:
+    """Where uploaded documents are kept. `upload_file` is blocking and runs on a worker thread."""
+
+    def url_for(self, name: str) -> str:
+        raise NotImplementedError
+
+    def upload_file(self, name: str, path: str) -> str:
+        raise NotImplementedError
+
+
+class AzureBlobStorage(StorageBackend):
+    def __init__(self, connection_string: str, container: str):
+        from azure.storage.blob import BlobServiceClient
+
+        block_size = AZURE_BLOCK_SIZE_MB * 1024 * 1024
+        # Anything above one block is staged as parallel blocks instead of a single PUT
+        self.service = BlobServiceClient.from_connection_string(
+            connection_string,
+            max_block_size=block_size,
+            max_single_put_size=block_size,
+        )
+        self.container = container
+
+    def url_for(self, name: str) -> str:
+        return f"https://{self.service.account_name}.blob.core.windows.net/{self.container}/{name}"
+
+    def upload_file(self, name: str, path: str) -> str:
+        blob_client = self.service.get_blob_client(container=self.container, blob=name)
+        with open(path, "rb") as stream:
+            blob_client.upload_blob(stream, overwrite=True, max_concurrency=AZURE_UPLOAD_CONCURRENCY)
+        return self.url_for(name)
+
+
+class LocalStorage(StorageBackend):
+    """Keeps documents under UPLOAD_DIRECTORY, served by the app at /{UPLOAD_DIRECTORY}. For dev and tests."""
+
+    def __init__(self, directory: str, base_url: str):
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+        os.makedirs(directory, exist_ok=True)
+
+    def url_for(self, name: str) -> str:
+        return f"{self.base_url}/{self.directory}/{name}"
+
+    def upload_file(self, name: str, path: str) -> str:
+        target = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target)
+        return self.url_for(name)
+
+
+def spool_upload(source, suffix: str = ""):
+    """Copy an upload stream to a temporary file in chunks; returns its path and the SHA-256 of the bytes."""
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=SPOOL_DIRECTORY, suffix=suffix, delete=False) as spool:
+        try:
+            while True:
+                block = source.read(1024 * 1024)
+                if not block:
+                    break
+                digest.update(block)
+                spool.write(block)
+        except BaseException:
+            # Don't leave a partial spool file behind
+            spool.close()
+            os.remove(spool.name)
+            raise
+    return spool.name, digest.hexdigest()
+
+
+def document_blob_name(content_hash: str, file_extension: str) -> str:
+    """Blob name of a shared document: its content hash, so it never reveals or depends on the uploader."""
+    return f"{content_hash}.{file_extension}"
+
+
+_storage = None
+
+
+def get_storage() -> StorageBackend:
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "local":
+            _storage = LocalStorage(UPLOAD_DIRECTORY, LOCAL_STORAGE_BASE_URL)
+        elif STORAGE_BACKEND == "azure":
+            _storage = AzureBlobStorage(AZURE_CONNECTION_STRING, CONTAINER_NAME)
+        else:
+            raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+    return _storage
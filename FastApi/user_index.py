@@ -0,0 +1,165 @@
+# user_index.py
+import os
+import threading
+import time
+from collections import OrderedDict
+import faiss
+import numpy as np
+from utils import normalize_vectors
+
+# Per-user cross-document indexes kept in memory (least recently searched users are dropped first)
+USER_INDEX_MAX_USERS = int(os.getenv("USER_INDEX_MAX_USERS", "200"))
+# Loaded indexes are rebuilt after this long, picking up chats finished or deleted by other workers
+USER_INDEX_TTL_SECONDS = float(os.getenv("USER_INDEX_TTL_SECONDS", "300"))
+
+
+class UserIndex:
+    """Exact inner-product index over every chunk of one user's chats, updated chat by chat.
+
+    Vectors get sequential ids so a chat's chunks can be removed without touching the rest.
+    Chunk texts and locations are kept alongside, so search results need no database reads.
+    """
+
+    def __init__(self):
+        self.index = None  # created with the dimension of the first chat added
+        self._next_id = 0
+        self._ids = {}  # chat_id -> np.ndarray of vector ids
+        self._entries = {}  # vector id -> (chat_id, chunk number)
+        self._chats = {}  # chat_id -> {"document_path", "file_name", "sentences", "chunks"}
+        self._lock = threading.Lock()
+        self.loaded_at = time.monotonic()
+
+    def __contains__(self, chat_id: str):
+        return chat_id in self._ids
+
+    def chat_ids(self) -> set:
+        with self._lock:
+            return set(self._ids)
+
+    @property
+    def ntotal(self) -> int:
+        return 0 if self.index is None else int(self.index.ntotal)
+
+    def add_chat(self, chat_id: str, vectors, sentences, chunks=None, document_path=None, file_name=None):
+        if len(vectors) == 0:
+            return
+        vectors = normalize_vectors(vectors)
+        with self._lock:
+            self._remove(chat_id)
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+            ids = np.arange(self._next_id, self._next_id + len(vectors), dtype="int64")
+            self._next_id += len(vectors)
+            self.index.add_with_ids(vectors, ids)
+
+            self._ids[chat_id] = ids
+            self._entries.update((int(i), (chat_id, n)) for n, i in enumerate(ids))
+            self._chats[chat_id] = {"document_path": document_path, "file_name": file_name, "sentences": sentences, "chunks": chunks or []}
+
+    def remove_chat(self, chat_id: str):
+        with self._lock:
+            self._remove(chat_id)
+
+    def _remove(self, chat_id: str):
+        ids = self._ids.pop(chat_id, None)
+        if ids is None:
+            return
+        self.index.remove_ids(ids)
+        for i in ids:
+            self._entries.pop(int(i), None)
+        self._chats.pop(chat_id, None)
+
+    def search(self, query_vector, k: int = 5):
+        """Top k chunks across all chats as dicts with chat_id, document_path, file_name, text, score and location."""
+        with self._lock:
+            if not self.ntotal:
+                return []
+            scores, ids = self.index.search(normalize_vectors(query_vector), min(k, self.ntotal))
+            results = []
+            for score, vector_id in zip(scores[0], ids[0]):
+                if vector_id < 0:
+                    continue
+                chat_id, n = self._entries[int(vector_id)]
+                chat = self._chats[chat_id]
+                location = chat["chunks"][n] if n < len(chat["chunks"]) else {}
+                results.append({
+                    "chat_id": chat_id,
+                    "document_path": chat["document_path"],
+                    "file_name": chat["file_name"],
+                    "text": chat["sentences"][n],
+                    "score": float(score),
+                    **location,
+                })
+            return results
+
+    def nbytes(self) -> int:
+        with self._lock:
+            if self.index is None:
+                return 0
+            text_bytes = sum(len(s) for chat in self._chats.values() for s in chat["sentences"])
+            return self.ntotal * (self.index.d * 4 + 8) + text_bytes
+
+
+class UserIndexCache:
+    """LRU of loaded UserIndex objects keyed by user_id, each kept for at most ttl_seconds."""
+
+    def __init__(self, max_users: int, ttl_seconds: float = None):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, user_id: str):
+        with self._lock:
+            index = self._entries.get(user_id)
+            if index is not None and self.ttl_seconds and time.monotonic() - index.loaded_at > self.ttl_seconds:
+                del self._entries[user_id]
+                self.expirations += 1
+                index = None
+            if index is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return index
+
+    def peek(self, user_id: str):
+        """The loaded index, without counting a lookup (for incremental updates)."""
+        with self._lock:
+            return self._entries.get(user_id)
+
+    def put(self, user_id: str, index: UserIndex):
+        with self._lock:
+            # Keep an index that was loaded concurrently, it may already hold newer updates
+            index = self._entries.setdefault(user_id, index)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return index
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            indexes = list(self._entries.values())
+            return {
+                "users": len(indexes),
+                "vectors": sum(index.ntotal for index in indexes),
+                "bytes": sum(index.nbytes() for index in indexes),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+user_indexes = UserIndexCache(max_users=USER_INDEX_MAX_USERS, ttl_seconds=USER_INDEX_TTL_SECONDS)
@@ -1,56 +1,193 @@
 import faiss
+import os
+import re
+import threading
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from transformers import pipeline
+from bson.binary import Binary
+from transformers import TextIteratorStreamer
+from model_registry import get_embedding_model, get_summarizer
+from batcher import EmbeddingBatcher
 
-# Initialize embedding model
-model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+# Storage dtype for the packed embeddings blob ("float32" or "float16")
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
 
-# Initialize summarization model
-summarizer = pipeline("summarization", model="facebook/bart-large-cnn")
+# Micro-batching of query embeddings across concurrent requests
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "5"))
+
+query_batcher = EmbeddingBatcher(
+    lambda texts: get_embedding_model().encode(texts, batch_size=len(texts)),
+    max_batch_size=QUERY_BATCH_MAX_SIZE,
+    max_wait_ms=QUERY_BATCH_WAIT_MS,
+)
+
+# Index selection by vector count, and search-time accuracy/speed knobs
+INDEX_IVF_MIN_VECTORS = int(os.getenv("INDEX_IVF_MIN_VECTORS", "20000"))
+INDEX_HNSW_MIN_VECTORS = int(os.getenv("INDEX_HNSW_MIN_VECTORS", "200000"))
+INDEX_IVF_NPROBE = int(os.getenv("INDEX_IVF_NPROBE", "16"))
+INDEX_HNSW_M = int(os.getenv("INDEX_HNSW_M", "32"))
+INDEX_HNSW_EF_CONSTRUCTION = int(os.getenv("INDEX_HNSW_EF_CONSTRUCTION", "80"))
+INDEX_HNSW_EF_SEARCH = int(os.getenv("INDEX_HNSW_EF_SEARCH", "64"))
 
 ### Embedding Functions ###
 def embed_text(text):
-    """Convert text into an embedding vector."""
-    return model.encode([text])[0]
+    """Convert text into an embedding vector (batched with other in-flight queries)."""
+    return query_batcher.encode(text)
+
+def embed_texts(texts):
+    """Embedding vectors of several texts, encoded in the same batch where possible."""
+    return query_batcher.encode_many(texts)
+
+def pack_embeddings(vectors, dtype=EMBEDDING_STORAGE_DTYPE):
+    """Pack an (n, dim) embedding matrix into a single BSON Binary blob plus its layout fields."""
+    if dtype not in ("float32", "float16"):
+        raise ValueError(f"Unsupported embedding storage dtype: {dtype}")
+    matrix = np.ascontiguousarray(vectors, dtype=dtype)
+    dim = matrix.shape[1] if matrix.ndim == 2 else 0
+    return {
+        "embeddings": Binary(matrix.tobytes()),
+        "embedding_dtype": dtype,
+        "embedding_dim": dim,
+    }
+
+def unpack_embeddings(chat):
+    """Read a chat's embeddings as a float32 matrix, accepting both the packed and the legacy list layout."""
+    value = chat.get("embeddings")
+    if value is None or len(value) == 0:
+        return np.empty((0, 0), dtype="float32")
+    if isinstance(value, bytes):
+        # Packed layout: decode without copying (float16 is widened once for FAISS)
+        dim = chat["embedding_dim"]
+        matrix = np.frombuffer(value, dtype=chat.get("embedding_dtype", "float32")).reshape(-1, dim)
+        return matrix.astype("float32", copy=False)
+    # Legacy layout: list of lists of BSON doubles
+    return np.asarray(value, dtype="float32")
+
+def normalize_vectors(vectors):
+    """Return a float32 copy of the vectors scaled to unit length, so inner product equals cosine similarity."""
+    vectors = np.array(vectors, dtype="float32", copy=True, ndmin=2)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def choose_index_type(count):
+    """Pick the index type for a chat by its vector count."""
+    if count >= INDEX_HNSW_MIN_VECTORS:
+        return "hnsw"
+    if count >= INDEX_IVF_MIN_VECTORS:
+        return "ivf"
+    return "flat"
+
+def make_faiss_index(vectors, index_type, nprobe=None, ef_search=None):
+    """Build an inner-product index of the given type over already normalized vectors."""
+    count, dim = vectors.shape
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == "ivf":
+        # ~4*sqrt(n) lists, but never more than the training set can support
+        nlist = max(1, min(int(4 * np.sqrt(count)), count // 39))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.nprobe = nprobe or INDEX_IVF_NPROBE
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, INDEX_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = INDEX_HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = ef_search or INDEX_HNSW_EF_SEARCH
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    index.add(vectors)
+    return index
 
 def build_faiss_index(vectors):
-    """Build a FAISS index for similarity search."""
-    if not vectors:
+    """Build a FAISS index for similarity search (exact for small chats, approximate for large ones)."""
+    if len(vectors) == 0:
         raise ValueError("No vectors provided for FAISS indexing")
     
-    dim = len(vectors[0])
-    index = faiss.IndexFlatL2(dim)
-    index.add(np.array(vectors).astype("float32"))
-    return index
+    vectors = normalize_vectors(vectors)
+    return make_faiss_index(vectors, choose_index_type(len(vectors)))
 
 def search_faiss(index, query_vector, k=3):
-    """Search for the most relevant sentences based on similarity."""
+    """Search for the most relevant sentences based on cosine similarity (higher scores are closer)."""
     if index is None:
         raise ValueError("FAISS index not initialized")
     
-    query_vector = np.array([query_vector]).astype("float32")
-    distances, indices = index.search(query_vector, k)
-    return indices[0], distances[0]
+    query_vector = normalize_vectors(query_vector)
+    scores, indices = index.search(query_vector, k)
+    return indices[0], scores[0]
 
 ### Response Structuring ###
+def combine_sentences(top_sentences):
+    """Join the retrieved sentences into one summarizer input, dropping blanks and duplicates."""
+    unique_sentences = list(dict.fromkeys(sent.strip() for sent in top_sentences if sent.strip()))
+    return " ".join(unique_sentences)
+
+# Question words that shouldn't be highlighted in extractive answers
+HIGHLIGHT_STOPWORDS = {
+    "the", "and", "for", "are", "was", "were", "what", "when", "where", "which", "who", "whom", "why",
+    "how", "does", "did", "can", "could", "should", "would", "will", "this", "that", "these", "those",
+    "with", "from", "about", "into", "there", "their", "they", "them", "you", "your", "have", "has",
+    "had", "not", "any", "all", "its", "our", "than", "then", "tell", "please", "document",
+}
+
+def highlight_spans(text, query):
+    """(start, end) offsets of the words in `text` that start with a content word of the query."""
+    terms = {word for word in re.findall(r"\w+", query.lower()) if len(word) > 2 and word not in HIGHLIGHT_STOPWORDS}
+    if not terms:
+        return []
+    # Drop a plural "s" and prefix match, so "invoices" also marks "invoice" and "invoiced"
+    terms = {term[:-1] if len(term) > 4 and term.endswith("s") else term for term in terms}
+    pattern = re.compile(r"\b(?:" + "|".join(sorted(map(re.escape, terms), key=len, reverse=True)) + r")\w*", re.IGNORECASE)
+    return [[match.start(), match.end()] for match in pattern.finditer(text)]
+
+def extractive_response(top_sentences, scores, query):
+    """Answer with the retrieved passages themselves, best first, with their scores and query-term matches."""
+    ranked = [
+        {"text": sentence.strip(), "score": float(score), "highlights": highlight_spans(sentence.strip(), query)}
+        for sentence, score in zip(top_sentences, scores)
+        if sentence.strip()
+    ]
+    if not ranked:
+        return "No relevant information found.", []
+    return combine_sentences(top_sentences), ranked
+
 def structure_response(top_sentences):
     """Generate a structured response summary from top retrieved sentences."""
     if not top_sentences:
         return "No relevant information found."
     
-    seen = set()
-    unique_sentences = [sent.strip() for sent in top_sentences if sent.strip() and sent.strip() not in seen]
-    seen.update(unique_sentences)
-
-    combined_text = " ".join(unique_sentences)
+    combined_text = combine_sentences(top_sentences)
 
     # Generate summary based on combined relevant sentences
-    summary_output = summarizer(
+    summary_output = get_summarizer()(
         combined_text,
         max_length=500,
         min_length=30,
         do_sample=False
     )
     
-    return summary_output[0]['summary_text']
\ No newline at end of file
+    return summary_output[0]['summary_text']
+
+def stream_response(top_sentences):
+    """Yield the answer for the retrieved sentences piece by piece as BART decodes it."""
+    combined_text = combine_sentences(top_sentences)
+    if not combined_text:
+        yield "No relevant information found."
+        return
+
+    summarizer = get_summarizer()
+    tokenizer, model = summarizer.tokenizer, summarizer.model
+    inputs = tokenizer(combined_text, return_tensors="pt", truncation=True, max_length=1024).to(model.device)
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+    # Streamers don't support beam search, so streamed answers are decoded greedily
+    generation = threading.Thread(
+        target=model.generate,
+        kwargs=dict(**inputs, streamer=streamer, max_length=500, min_length=30, num_beams=1, do_sample=False),
+        daemon=True,
+    )
+    generation.start()
+    for text in streamer:
+        if text:
+            yield text
+    generation.join()
@@ -2,6 +2,7 @@ import React, { useState } from 'react';
 import { Link, useNavigate, useLocation } from 'react-router-dom';
 import { useAuth } from '../context/AuthContext';
 import { useChat } from '../context/ChatContext';
+import { chatFileName } from '../utils/chatUtils';
 import { 
   FileText, 
   MessageSquare, 
@@ -132,7 +133,7 @@ const Sidebar = () => {
                       <MessageSquare size={16} className="mt-0.5 shrink-0" />
                       <div className="flex-1 min-w-0">
                         <div className="flex justify-between items-center">
-                          <p className="font-medium truncate">{chat.document_path.split('/').pop()}</p>
+                          <p className="font-medium truncate">{chatFileName(chat)}</p>
                           <button 
                             onClick={(e) => handleChatDelete(e, chat._id)}
                             className="hidden group-hover:block text-slate-500 hover:text-red-400 p-1"
@@ -140,7 +141,7 @@ const Sidebar = () => {
                             <Trash2 size={14} />
                           </button>
                         </div>
-                        <p className="text-xs text-slate-500 truncate">{chat.document_path.split('/').pop()}</p>
+                        <p className="text-xs text-slate-500 truncate">{chatFileName(chat)}</p>
                         <p className="text-xs text-slate-400">{formatRelativeTime(chat.timestamp)}</p>
                       </div>
                     </Link>
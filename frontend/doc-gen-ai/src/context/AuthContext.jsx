@@ -50,10 +50,13 @@ export const AuthProvider = ({ children }) => {
       const data = await response.json();
       console.log(data)
 
+      // Message history is loaded per chat when it is opened
+      const chats = data.chats.map(chat => ({ ...chat, messages: [], messagesLoaded: false }));
+
       // Store user data in localStorage
       setUser(data);
       localStorage.setItem("docgenius_user", JSON.stringify({ ...data }));
-      localStorage.setItem("docgenius_chats", JSON.stringify(data.chats));
+      localStorage.setItem("docgenius_chats", JSON.stringify(chats));
       // setUser(JSON.parse(data.user))
       // navigate('/dashboard');
 
@@ -107,8 +110,23 @@ export const AuthProvider = ({ children }) => {
     setUser(null);
   };
 
+  // fetch() against the API with the user's bearer token; an expired session logs the user out
+  const authFetch = async (path, options = {}) => {
+    const response = await fetch(import.meta.env.VITE_API_URL + path, {
+      ...options,
+      headers: {
+        ...options.headers,
+        Authorization: `Bearer ${user?.token?.access_token}`,
+      },
+    });
+    if (response.status === 401) {
+      logout();
+    }
+    return response;
+  };
+
   return (
-    <AuthContext.Provider value={{ user, loading, login, signup, logout }}>
+    <AuthContext.Provider value={{ user, loading, login, signup, logout, authFetch }}>
       {children}
     </AuthContext.Provider>
   );
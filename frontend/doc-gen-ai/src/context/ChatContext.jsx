@@ -11,7 +11,7 @@ export const useChat = () => {
 };
 
 export const ChatProvider = ({ children }) => {
-  const { user } = useAuth();
+  const { user, authFetch } = useAuth();
   const [chats, setChats] = useState([]);
   const [currentChat, setCurrentChat] = useState(null);
 
@@ -43,9 +43,12 @@ export const ChatProvider = ({ children }) => {
       size: upload.size,
       type: upload.type,
       document_path : upload.document_path,
+      file_name: upload.file_name,
       timestamp: new Date().toISOString(),
       updatedAt: new Date().toISOString(),
-      messages: []
+      messages: [],
+      messagesLoaded: true,
+      message_count: 0
     };
     
     setChats(prevChats => [newChat, ...prevChats]);
@@ -81,7 +84,7 @@ export const ChatProvider = ({ children }) => {
 
   try {
     // Send POST request with chat_id and text to the API
-    const response = await fetch(import.meta.env.VITE_API_URL+'/chat/message', {
+    const response = await authFetch('/chat/message', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -105,6 +108,7 @@ export const ChatProvider = ({ children }) => {
       ...currentChat,
       updatedAt: new Date().toISOString(),
       messages: [...currentChat.messages, data],
+      message_count: (currentChat.message_count || 0) + 1,
     };
 
     // // Update state with the new chat messages that include the AI's reply
@@ -120,17 +124,40 @@ export const ChatProvider = ({ children }) => {
   }
 };
 
+  // Fetch a page of message history (newest page first, older pages via `before`)
+  const loadMessages = async (chatId, before = null) => {
+    try {
+      const params = new URLSearchParams({ limit: '50' });
+      if (before) params.append('before', before);
+      const response = await authFetch(`/chat/${chatId}/messages?${params}`);
+      if (!response.ok) {
+        throw new Error('Failed to load messages');
+      }
+      const data = await response.json();
+
+      const update = chat => chat._id === chatId
+        ? {
+            ...chat,
+            messages: before ? [...data.messages, ...chat.messages] : data.messages,
+            messagesLoaded: true,
+            nextBefore: data.next_before,
+          }
+        : chat;
+      setChats(prevChats => prevChats.map(update));
+      setCurrentChat(prevChat => (prevChat ? update(prevChat) : prevChat));
+    } catch (error) {
+      console.error('Error loading messages:', error);
+    }
+  };
+
   const getChat = (chatId) => {
     return chats.find(chat => chat._id === chatId);
   };
 
   const deleteChat = async (chatId) => {
   try {
-    // Get user ID from props or context
-    const userId = user._id;
-
-    // Send DELETE request to backend
-    const response = await fetch(`${import.meta.env.VITE_API_URL}/chat/delete?chat_id=${chatId}&user_id=${userId}`, {
+    // Send DELETE request to backend (the user comes from the bearer token)
+    const response = await authFetch(`/chat/delete?chat_id=${chatId}`, {
       method: 'DELETE',
     });
 
@@ -163,6 +190,7 @@ export const ChatProvider = ({ children }) => {
       setCurrentChat,
       createNewChat,
       sendMessage,
+      loadMessages,
       getChat,
       deleteChat
     }}>
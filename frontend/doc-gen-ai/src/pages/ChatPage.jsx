@@ -2,6 +2,7 @@ import React, { useState, useEffect, useRef, use } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { useChat } from '../context/ChatContext';
 import { useAuth } from '../context/AuthContext';
+import { chatFileName } from '../utils/chatUtils';
 import {
   Send,
   FileUp,
@@ -22,12 +23,17 @@ import {
   X
 } from 'lucide-react';
 
+// How often to poll a processing upload, and when to give up on it
+const UPLOAD_POLL_INTERVAL_MS = 1500;
+const UPLOAD_PROCESSING_TIMEOUT_MS = 15 * 60 * 1000;
+
 const ChatPage = ({ isNew = false }) => {
   const { chatId } = useParams();
-  const { user } = useAuth();
-  const { getChat, createNewChat, sendMessage, currentChat, setCurrentChat } = useChat();
+  const { authFetch } = useAuth();
+  const { getChat, createNewChat, sendMessage, loadMessages, currentChat, setCurrentChat } = useChat();
   const [message, setMessage] = useState('');
   const [isUploading, setIsUploading] = useState(false);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
   const [documentDetails, setDocumentDetails] = useState(null);
   const [showDocumentInfo, setShowDocumentInfo] = useState(false);
   const [showOneTimeInput, setShowOneTimeInput] = useState('');
@@ -44,17 +50,40 @@ const ChatPage = ({ isNew = false }) => {
       const chat = getChat(chatId);
       if (chat) {
         setCurrentChat(chat);
+        if (!chat.messagesLoaded) {
+          loadMessages(chat._id);
+        }
       } else {
         // Chat not found, redirect to dashboard
         navigate('/dashboard');
       }
     }
-  }, [chatId, isNew, getChat, setCurrentChat, navigate]);
+  }, [chatId, isNew, getChat, setCurrentChat, loadMessages, navigate]);
 
   // Scroll to bottom when messages change
+  // Scroll down for new messages, not when older ones are prepended
+  const lastMessage = currentChat?.messages?.[currentChat.messages.length - 1];
   useEffect(() => {
     messageEndRef.current?.scrollIntoView({ behavior: 'smooth' });
-  }, [currentChat?.messages]);
+  }, [lastMessage]);
+
+  // The history is paged: fetch the page before the oldest loaded message
+  const loadOlderMessages = async () => {
+    const container = chatContainerRef.current;
+    const previousHeight = container ? container.scrollHeight : 0;
+    setIsLoadingOlder(true);
+    try {
+      await loadMessages(currentChat._id, currentChat.nextBefore);
+    } finally {
+      setIsLoadingOlder(false);
+    }
+    // Keep the messages that were on screen in place
+    requestAnimationFrame(() => {
+      if (container) {
+        container.scrollTop += container.scrollHeight - previousHeight;
+      }
+    });
+  };
 
   // Handle document upload
   const handleFileUpload = async (e) => {
@@ -74,11 +103,10 @@ const ChatPage = ({ isNew = false }) => {
     
     try {
       setIsUploading(true);
-      // Step 1: Create FormData and append the file and user_id
+      // Step 1: Create FormData with the file (the user comes from the bearer token)
       const formData = new FormData();
       formData.append('file', file);
-      formData.append('user_id', user._id);  // Send the user_id as part of the FormData
-      const uploadResponse = await fetch(`${import.meta.env.VITE_API_URL}/chat/create`, {
+      const uploadResponse = await authFetch('/chat/create', {
         method: 'POST',
         body: formData,
       });
@@ -86,10 +114,25 @@ const ChatPage = ({ isNew = false }) => {
       if (!uploadResponse.ok) {
         throw new Error('Error uploading file');
       }
-      const upload = await uploadResponse.json();
+      let upload = await uploadResponse.json();
       // const fileUrl = uploadData.url;
       console.log(upload);
 
+      // The document is processed in the background, wait until its summary is ready
+      const deadline = Date.now() + UPLOAD_PROCESSING_TIMEOUT_MS;
+      while (upload.status !== 'done') {
+        if (Date.now() > deadline) {
+          throw new Error('Timed out waiting for the document to be processed');
+        }
+        await new Promise(resolve => setTimeout(resolve, UPLOAD_POLL_INTERVAL_MS));
+        const statusResponse = await authFetch(`/chat/status/${upload._id}`);
+        const status = await statusResponse.json();
+        if (!statusResponse.ok || status.status === 'failed') {
+          throw new Error(status.error || 'Error processing document');
+        }
+        upload = { ...upload, ...status };
+      }
+
       const details = {
         name: file.name,
         type: fileExt,
@@ -287,8 +330,8 @@ const ChatPage = ({ isNew = false }) => {
             <div className="flex items-center">
               {getFileIcon(currentChat.type)}
               <div className="ml-3">
-                <h1 className="text-lg font-semibold text-slate-100">{currentChat.document_path.split('/').pop()}</h1>
-                <p className="text-xs text-slate-500">{currentChat.document_path.split('/').pop()}</p>
+                <h1 className="text-lg font-semibold text-slate-100">{chatFileName(currentChat)}</h1>
+                <p className="text-xs text-slate-500">{chatFileName(currentChat)}</p>
               </div>
             </div>
           </div>
@@ -308,6 +351,18 @@ const ChatPage = ({ isNew = false }) => {
 
       {/* Chat Container */}
       <div className="flex-1 overflow-y-auto p-4" ref={chatContainerRef}>
+        {currentChat.nextBefore && (
+          <div className="flex justify-center mb-4">
+            <button
+              onClick={loadOlderMessages}
+              disabled={isLoadingOlder}
+              className="inline-flex items-center px-3 py-1.5 text-xs rounded-full bg-slate-800 text-slate-300 hover:bg-slate-700 disabled:opacity-50"
+            >
+              {isLoadingOlder && <Loader size={14} className="mr-1.5 animate-spin" />}
+              {isLoadingOlder ? 'Loading older messages' : 'Load older messages'}
+            </button>
+          </div>
+        )}
         {currentChat.messages.map((msg, index) => (
           <>
           <div
@@ -460,7 +515,7 @@ const ChatPage = ({ isNew = false }) => {
               {getFileIcon(currentChat.type)}
             </div> */}
 
-            <h3 className="text-xl font-medium text-center mb-6">{currentChat.document_path.split('/').pop()}</h3>
+            <h3 className="text-xl font-medium text-center mb-6">{chatFileName(currentChat)}</h3>
 
             <div className="card p-4 mb-4">
               <div className="flex items-center justify-between text-sm mb-3">
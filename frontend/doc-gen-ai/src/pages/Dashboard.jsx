@@ -2,6 +2,7 @@ import React, { useState } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import { useChat } from '../context/ChatContext';
 import { useAuth } from '../context/AuthContext';
+import { chatFileName } from '../utils/chatUtils';
 import { 
   FileText, 
   MessageSquare, 
@@ -24,8 +25,8 @@ const Dashboard = () => {
   // Filter chats based on search term
   const filteredChats = searchTerm
     ? chats.filter(chat => 
-        chat.document_path.split('/').pop().toLowerCase().includes(searchTerm.toLowerCase()) ||
-        chat.document_path.split('/').pop().toLowerCase().includes(searchTerm.toLowerCase())
+        chatFileName(chat).toLowerCase().includes(searchTerm.toLowerCase()) ||
+        chatFileName(chat).toLowerCase().includes(searchTerm.toLowerCase())
       )
     : chats;
 
@@ -173,15 +174,15 @@ const Dashboard = () => {
                     </span>
                   </div>
                   <h3 className="font-medium text-lg mb-1 text-slate-200 group-hover:text-primary-300 transition-colors duration-200 truncate">
-                    {chat.document_path.split('/').pop()}
+                    {chatFileName(chat)}
                   </h3>
                   <p className="text-sm text-slate-400 truncate mb-3">
-                    {chat.document_path.split('/').pop()}
+                    {chatFileName(chat)}
                   </p>
                   <div className="flex items-center justify-between text-xs text-slate-500">
                     <span className="flex items-center gap-1">
                       <MessageSquare size={14} />
-                      {chat.messages.length} messages
+                      {chat.message_count ?? chat.messages.length} messages
                     </span>
                     <span>{formatDate(chat.timestamp)}</span>
                   </div>
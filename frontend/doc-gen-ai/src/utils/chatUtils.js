@@ -0,0 +1,7 @@
+/**
+ * The name of the file a chat was created from
+ * Shared documents are stored under their content hash, so the uploader's own file name is kept on the chat
+ * @param {object} chat - Chat with file_name and document_path
+ * @returns {string} - File name to display
+ */
+export const chatFileName = (chat) => chat.file_name || chat.document_path.split('/').pop();